@@ -0,0 +1,511 @@
+"""
+Benchmarks for the ingestion and query hot paths in main.py and processing.py.
+
+Usage:
+    python benchmark.py extract <pdf> [--workers 1 2 4 8]
+    python benchmark.py ann [<pdf> ...] [--synthetic N] [--factories Flat IVF1024,Flat HNSW32]
+    python benchmark.py polish [--stub] [--concurrency 1 4 8]
+    python benchmark.py embed <pdf> [...] [--backends torch onnx onnx-int8]
+    python benchmark.py batching <pdf> [...] [--budgets 2048 4096 8192]
+    python benchmark.py startup [--max-seconds 2]
+    python benchmark.py structure [<pdf>] [--pages 1000]
+    python benchmark.py chunking [<pdf>] [--pages 5000] [--max-words 350] [--overlap 0 50] [--tokens]
+"""
+import argparse
+import hashlib
+import json
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import faiss
+import numpy as np
+
+import processing
+
+
+def bench_extract(pdf_path: str, workers: list[int], repeats: int = 3):
+    """
+    Measure page extraction throughput of `load_pdf_pages` for several worker counts.
+
+    Parameters:
+        pdf_path (str): PDF to extract.
+        workers (list[int]): Worker counts to compare; 1 is the serial path.
+        repeats (int): Runs per worker count; the fastest run is reported.
+    """
+    baseline = None
+    for count in workers:
+        best = float('inf')
+        for _ in range(repeats):
+            started = time.perf_counter()
+            pages = list(main.load_pdf_pages(pdf_path, workers=count))
+            best = min(best, time.perf_counter() - started)
+        rate = len(pages) / best
+        baseline = baseline or rate
+        print(f'workers={count:<3} pages={len(pages):<6} {rate:9.1f} pages/s  speedup={rate / baseline:.2f}x')
+
+
+def load_texts(pdf_paths: list[str]) -> list[str]:
+    """
+    Chunk the given PDFs the way an upload would (cached chunks are reused).
+    
+    Returns:
+        list[str]: Chunk texts of all PDFs, in order.
+    """
+    texts = []
+    for pdf_path in pdf_paths:
+        with open(pdf_path, 'rb') as fp: file_hash = hashlib.sha256(fp.read()).hexdigest()
+        texts.extend(c['text'] for c in main.chunk_pdf(pdf_path, file_hash, pdf_path))
+    return texts
+
+
+def load_corpus(pdf_paths: list[str], synthetic: int, dim: int = 384) -> np.ndarray:
+    """
+    Build the vectors to index: chunk embeddings of the given PDFs, or random unit vectors.
+
+    Parameters:
+        pdf_paths (list[str]): PDFs to chunk and embed (cached embeddings are reused).
+        synthetic (int): Number of random vectors to generate when no PDFs are given.
+        dim (int): Dimension of the synthetic vectors.
+
+    Returns:
+        np.ndarray: Normalized float32 matrix with one row per vector.
+    """
+    if not pdf_paths:
+        vectors = np.random.default_rng(0).standard_normal((synthetic, dim), dtype='float32')
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    return np.concatenate([main.embed_texts(batch) for batch in main.batched(load_texts(pdf_paths), main.EMBED_BATCH_SIZE)])
+
+
+def bench_ann(vectors: np.ndarray, factories: list[str], queries: int, k: int, nprobes: list[int], ef_searches: list[int]):
+    """
+    Compare approximate index types against exact search on the same vectors.
+
+    Queries are perturbed copies of corpus vectors. For every factory and search setting, reports recall@k against `Flat`, batch throughput and single-query latency.
+
+    Parameters:
+        vectors (np.ndarray): Normalized float32 corpus.
+        factories (list[str]): Index factory strings accepted by `main.create_index`.
+        queries (int): Number of queries to run.
+        k (int): Number of neighbours retrieved per query.
+        nprobes (list[int]): `nprobe` values tried for IVF indexes.
+        ef_searches (list[int]): `efSearch` values tried for HNSW indexes.
+    """
+    rng = np.random.default_rng(1)
+    sample = vectors[rng.choice(len(vectors), size=queries)]
+    xq = (sample + 0.1 * rng.standard_normal(sample.shape, dtype='float32') / np.sqrt(vectors.shape[1])).astype('float32')
+    faiss.normalize_L2(xq)
+
+    ids = np.arange(len(vectors), dtype='int64')
+    exact = main.create_index(vectors.shape[1], 'Flat')
+    exact.add_with_ids(vectors, ids)
+    _, truth = exact.search(xq, k)
+
+    print(f'vectors={len(vectors)} dim={vectors.shape[1]} queries={queries} k={k}')
+    for factory in factories:
+        index = main.create_index(vectors.shape[1], factory)
+        started = time.perf_counter()
+        if not index.is_trained: index.train(vectors[:main.INDEX_TRAIN_SIZE])
+        index.add_with_ids(vectors, ids)
+        build = time.perf_counter() - started
+
+        if faiss.try_extract_index_ivf(index) is not None: settings = [{'nprobe': n} for n in nprobes]
+        elif 'HNSW' in factory: settings = [{'ef_search': ef} for ef in ef_searches]
+        else: settings = [{}]
+
+        for setting in settings:
+            params = main.search_parameters(index, **setting)
+
+            started = time.perf_counter()
+            _, found = index.search(xq, k, params=params)
+            qps = queries / (time.perf_counter() - started)
+
+            latencies = []
+            for q in xq[:200]:
+                started = time.perf_counter()
+                index.search(q[None, :], k, params=params)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            label = ' '.join(f'{key}={value}' for key, value in setting.items())
+            print(
+                f'{factory:<16} {label:<14} recall@{k}={recall:.3f} qps={qps:9.0f} '
+                f'p50={np.percentile(latencies, 50):.3f}ms p99={np.percentile(latencies, 99):.3f}ms build={build:.1f}s'
+            )
+
+
+def bench_embed(texts: list[str], backends: list[str], queries: int, k: int):
+    """
+    Compare embedding backends on the same chunks: encoding throughput, and agreement with the first backend.
+    
+    Agreement is reported as the mean cosine similarity between each chunk's two embeddings, and as the overlap of the top-k chunks retrieved for questions made from the first words of sampled chunks.
+    
+    Parameters:
+        texts (list[str]): Chunk texts to embed.
+        backends (list[str]): Backends accepted by `main.load_embedder`; the first is the reference.
+        queries (int): Number of retrieval questions.
+        k (int): Number of chunks retrieved per question.
+    """
+    rng = np.random.default_rng(2)
+    questions = [' '.join(texts[i].split()[:12]) for i in rng.choice(len(texts), size=queries)]
+    reference = None
+
+    print(f'chunks={len(texts)} queries={queries} k={k}')
+    for backend in backends:
+        model = main.load_embedder(backend)
+        model.encode(texts[:64])
+
+        started = time.perf_counter()
+        vectors = model.encode(texts, normalize_embeddings=True).astype('float32')
+        rate = len(texts) / (time.perf_counter() - started)
+
+        index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+        _, found = index.search(model.encode(questions, normalize_embeddings=True).astype('float32'), k)
+
+        reference = reference or (rate, vectors, found)
+        cosine = np.mean(np.sum(vectors * reference[1], axis=1))
+        agreement = np.mean([len(set(f) & set(r)) / k for f, r in zip(found.tolist(), reference[2].tolist())])
+        print(f'{backend:<10} {rate:8.1f} chunks/s  speedup={rate / reference[0]:.2f}x  cosine={cosine:.4f}  top{k}_agreement={agreement:.3f}')
+
+
+def padded_tokens(lengths: list[int], batches: list[list[int]]) -> int:
+    """
+    Count the tokens fed to the model, padding included, when encoding `batches` (lists of positions into `lengths`).
+    """
+    return sum(max(lengths[i] for i in batch) * len(batch) for batch in batches)
+
+
+def bench_batching(texts: list[str], budgets: list[int], repeats: int = 3):
+    """
+    Compare fixed-size embedding batches with `processing.encode_texts` token-budget batches on upload-sized groups of chunks.
+    
+    The baseline is a plain `embedder.encode` call per `EMBED_BATCH_SIZE` group, which sorts by character length and encodes 32 texts at a time. For each approach, reports throughput, padding overhead (padded tokens over real tokens) and the largest difference from the baseline vectors.
+    
+    Parameters:
+        texts (list[str]): Chunk texts, in upload order.
+        budgets (list[int]): Token budgets to try.
+        repeats (int): Runs per approach; the fastest run is reported.
+    """
+    model = main.get_embedder()
+    groups = list(main.batched(texts, main.EMBED_BATCH_SIZE))
+    lengths = [
+        [len(ids) for ids in model.tokenizer(group, truncation=True, max_length=model.max_seq_length)['input_ids']]
+        for group in groups
+    ]
+    real = sum(map(sum, lengths))
+
+    def run(encode) -> tuple[float, np.ndarray]:
+        best = float('inf')
+        for _ in range(repeats):
+            started = time.perf_counter()
+            vectors = np.concatenate([encode(group) for group in groups])
+            best = min(best, time.perf_counter() - started)
+        return len(texts) / best, vectors
+
+    baseline, reference = run(lambda group: model.encode(group, normalize_embeddings=True).astype('float32'))
+    padded = 0
+    for group, group_lengths in zip(groups, lengths):
+        order = sorted(range(len(group)), key=lambda i: -len(group[i]))
+        padded += padded_tokens(group_lengths, [order[i:i + 32] for i in range(0, len(order), 32)])
+    print(f'chunks={len(texts)} tokens={real}')
+    print(f'{"fixed batch=32":<18} {baseline:8.1f} chunks/s  speedup=1.00x  padding={padded / real - 1:6.1%}')
+
+    for budget in budgets:
+        rate, vectors = run(lambda group: processing.encode_texts(model, group, budget, main.EMBED_LENGTH_BUCKET))
+        padded = sum(padded_tokens(group_lengths, processing.length_batches(group_lengths, budget, main.EMBED_LENGTH_BUCKET)) for group_lengths in lengths)
+        print(
+            f'{f"budget={budget}":<18} {rate:8.1f} chunks/s  speedup={rate / baseline:.2f}x  padding={padded / real - 1:6.1%}  '
+            f'max_diff={np.abs(vectors - reference).max():.2e}'
+        )
+
+
+def synthetic_pages(count: int, lines_per_page: int = 40) -> list[dict]:
+    """
+    Generate textbook-like pages: mostly body text, with numbered lists, a section heading every few pages and a unit heading every fifty.
+    """
+    rng = np.random.default_rng(3)
+    words = 'the of a process system model value energy function data structure example result method theory'.split()
+    pages = []
+    for number in range(1, count + 1):
+        lines = []
+        if number % 50 == 1: lines.append(f'UNIT {["I", "II", "III", "IV", "V", "VI"][(number // 50) % 6]} Foundations')
+        if number % 4 == 1: lines.append(f'{number // 50 + 1}.{number % 50 // 4 + 1} Section on {rng.choice(words)}')
+        for i in range(lines_per_page - len(lines)):
+            body = ' '.join(rng.choice(words, size=12))
+            lines.append(f'{i % 9 + 1}) {body}' if i % 10 == 0 else body.capitalize() + '.')
+        pages.append({'page_number': number, 'text': '\n'.join(lines)})
+    return pages
+
+
+def bench_structure(pages: list[dict], repeats: int = 5):
+    """
+    Compare `StructurePipeline`'s per-detector loop with `CompiledStructurePipeline`, line by line and a page at a time, on a whole book, and check that all three produce the same updates.
+    
+    Parameters:
+        pages (list[dict]): Pages with `page_number` and `text`.
+        repeats (int): Runs per pipeline; the fastest run is reported.
+    """
+    lines = [line.strip() for page in pages for line in page['text'].splitlines() if line.strip()]
+    detectors = [processing.UnitDetector(), processing.NumberedSectionDetector()]
+    print(f'pages={len(pages)} lines={len(lines)}')
+
+    baseline = reference = None
+    for pipeline_class in (processing.StructurePipeline, processing.CompiledStructurePipeline):
+        best = float('inf')
+        for _ in range(repeats):
+            pipeline = pipeline_class(detectors)
+            started = time.perf_counter()
+            results = [pipeline.process_line(line) for line in lines]
+            best = min(best, time.perf_counter() - started)
+
+        reference = reference or results
+        rate = len(lines) / best
+        baseline = baseline or rate
+        print(f'{pipeline_class.__name__:<28} {rate:11.0f} lines/s  speedup={rate / baseline:.2f}x  identical={results == reference}')
+
+    best = float('inf')
+    for _ in range(repeats):
+        pipeline = processing.CompiledStructurePipeline(detectors)
+        started = time.perf_counter()
+        updates = [state for page in pages for _, state in pipeline.process_page(page['text'])]
+        best = min(best, time.perf_counter() - started)
+    rate = len(lines) / best
+    print(f'{"process_page":<28} {rate:11.0f} lines/s  speedup={rate / baseline:.2f}x  identical={updates == [state for updated, state in reference if updated]}')
+
+
+def bench_chunking(pages: list[dict], max_words: int, overlaps: list[int], repeats: int = 5, tokens: bool = False):
+    """
+    Measure `structured_chunker` throughput and peak traced memory on a whole book, for each overlap setting.
+    
+    With `tokens`, also chunk the book both ways `main.chunk_sizing` configures the chunker, by words and by the embedding model's tokens, and report how many chunks and tokens the model would truncate in each mode.
+    
+    Parameters:
+        pages (list[dict]): Pages with `page_number` and `text`.
+        max_words (int): Chunk size passed to the chunker.
+        overlaps (list[int]): Overlap settings to compare.
+        repeats (int): Timed runs per setting; the fastest run is reported.
+        tokens (bool): Also compare word and token chunking; loads the embedding model.
+    """
+    detectors = [processing.UnitDetector(), processing.NumberedSectionDetector()]
+    words = sum(len(page['text'].split()) for page in pages)
+    print(f'pages={len(pages)} words={words} max_words={max_words}')
+
+    for overlap in overlaps:
+        best = float('inf')
+        for _ in range(repeats):
+            started = time.perf_counter()
+            chunks = sum(1 for _ in processing.structured_chunker(pages, detectors, 'benchmark', max_words, overlap))
+            best = min(best, time.perf_counter() - started)
+
+        # Memory is traced in a separate run, since tracing slows allocation down.
+        tracemalloc.start()
+        for _ in processing.structured_chunker(pages, detectors, 'benchmark', max_words, overlap): pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'overlap={overlap:<4} chunks={chunks:<7} {words / best:11.0f} words/s  peak={peak / 1024:.0f} KiB')
+
+    if not tokens: return
+    model = main.get_embedder()
+    limit = model.max_seq_length - model.tokenizer.num_special_tokens_to_add()
+    for unit in ('words', 'tokens'):
+        tokenizer, max_size, overlap = main.chunk_sizing(unit)
+        started = time.perf_counter()
+        texts = [chunk['text'] for chunk in processing.structured_chunker(pages, detectors, 'benchmark', max_size, overlap, tokenizer)]
+        elapsed = time.perf_counter() - started
+
+        lengths = [len(ids) for ids in model.tokenizer(texts, add_special_tokens=False, verbose=False)['input_ids']]
+        dropped = sum(max(length - limit, 0) for length in lengths)
+        print(f'{unit:<6} size={max_size:<4} overlap={overlap:<3} chunks={len(texts):<7} {words / elapsed:11.0f} words/s  truncated={sum(length > limit for length in lengths)} chunks, {dropped / sum(lengths):.1%} of tokens')
+
+
+STARTUP_PROBE = '''
+import sys, time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started, *(m for m in ('torch', 'sentence_transformers') if m in sys.modules))
+'''
+
+
+def bench_startup(repeats: int, max_seconds: float = None) -> bool:
+    """
+    Measure how long a fresh interpreter takes to import `main`, and check that the model libraries are not imported with it.
+    
+    Parameters:
+        repeats (int): Number of fresh interpreters to time.
+        max_seconds (float): Optional limit on the median import time.
+    
+    Returns:
+        bool: False if `max_seconds` is given and the median exceeds it, or the model libraries were imported eagerly.
+    """
+    times, eager = [], set()
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', STARTUP_PROBE], capture_output=True, text=True, check=True)
+        seconds, *modules = result.stdout.splitlines()[-1].split()
+        times.append(float(seconds))
+        eager.update(modules)
+
+    median = statistics.median(times)
+    print(f'import main: median={median:.3f}s min={min(times):.3f}s max={max(times):.3f}s eagerly imported: {", ".join(sorted(eager)) or "none"}')
+    if max_seconds is not None and median > max_seconds: print(f'FAIL: median import time exceeds {max_seconds}s')
+    if eager: print('FAIL: model libraries are imported at startup')
+    return not eager and (max_seconds is None or median <= max_seconds)
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """
+    Stands in for the Ollama `/api/generate` endpoint: waits `latency` seconds, then echoes the last prompt line back with a prefix, streamed word by word as NDJSON when the request asks for `stream`.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.05
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency)
+        text = f"Polished: {request['prompt'].splitlines()[-1]}"
+
+        if not request.get('stream'):
+            body = json.dumps({'response': text, 'done': True}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            line = json.dumps({'response': word if i == 0 else f' {word}', 'done': False}).encode('utf-8') + b'\n'
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        line = json.dumps({'response': '', 'done': True}).encode('utf-8') + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n0\r\n\r\n' % (len(line), line))
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_ollama(latency: float) -> str:
+    """
+    Start a `StubOllamaHandler` server on a free local port in a background thread.
+
+    Returns:
+        str: Base URL of the stub server.
+    """
+    StubOllamaHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def bench_polish(url: str, concurrency: list[int], requests: int):
+    """
+    Measure polishing throughput and latency through `main.run_polish_model` at several concurrency levels.
+
+    Each request uses a distinct sentence, so `polish_cache` is not involved.
+
+    Parameters:
+        url (str): Base URL of the Ollama (or stub) server.
+        concurrency (list[int]): Numbers of concurrent callers to compare.
+        requests (int): Polishes per concurrency level.
+    """
+    for workers in concurrency:
+        main.ollama = main.OllamaClient(url, workers, main.POLISH_TIMEOUT)
+        latencies = []
+
+        def polish(i: int):
+            started = time.perf_counter()
+            polished = main.run_polish_model(f'Relevant content for question {workers}-{i} can be found on pages 1-2 of the textbook.')
+            latencies.append(time.perf_counter() - started)
+            return polished is not None
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool: succeeded = sum(pool.map(polish, range(requests)))
+        elapsed = time.perf_counter() - started
+        print(
+            f'concurrency={workers:<3} ok={succeeded}/{requests} {requests / elapsed:7.1f} req/s '
+            f'p50={np.percentile(latencies, 50) * 1000:.1f}ms p99={np.percentile(latencies, 99) * 1000:.1f}ms'
+        )
+
+
+if __name__ == '__main__':
+    # Imported only when run as a script: process pools start their workers with `spawn`, which re-imports this file in every worker, and they must not run main's setup (index store, caches, background threads).
+    import main
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    extract = commands.add_parser('extract', help='PDF page extraction, serial vs process pool')
+    extract.add_argument('pdf')
+    extract.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    extract.add_argument('--repeats', type=int, default=3)
+
+    ann = commands.add_parser('ann', help='Approximate index recall, QPS and latency against exact search')
+    ann.add_argument('pdfs', nargs='*')
+    ann.add_argument('--synthetic', type=int, default=100_000)
+    ann.add_argument('--factories', nargs='+', default=['Flat', 'IVF1024,Flat', 'IVF1024,PQ32', 'HNSW32'])
+    ann.add_argument('--queries', type=int, default=1000)
+    ann.add_argument('--k', type=int, default=5)
+    ann.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    ann.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256])
+
+    polish = commands.add_parser('polish', help='Answer polishing throughput over the Ollama HTTP API')
+    polish.add_argument('--url', default=main.OLLAMA_URL)
+    polish.add_argument('--stub', action='store_true', help='Run against a local stub server instead of Ollama')
+    polish.add_argument('--stub-latency', type=float, default=0.05)
+    polish.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    polish.add_argument('--requests', type=int, default=64)
+
+    embed = commands.add_parser('embed', help='Embedding backend throughput and agreement on the same chunks')
+    embed.add_argument('pdfs', nargs='+')
+    embed.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8'])
+    embed.add_argument('--queries', type=int, default=200)
+    embed.add_argument('--k', type=int, default=5)
+
+    batching = commands.add_parser('batching', help='Length-sorted token-budget embedding batches against fixed-size batches')
+    batching.add_argument('pdfs', nargs='+')
+    batching.add_argument('--budgets', type=int, nargs='+', default=[2048, 4096, 8192])
+    batching.add_argument('--repeats', type=int, default=3)
+
+    startup = commands.add_parser('startup', help='Import time of main.py; exits non-zero if it regresses')
+    startup.add_argument('--repeats', type=int, default=5)
+    startup.add_argument('--max-seconds', type=float)
+
+    structure = commands.add_parser('structure', help='Heading detection: per-detector loop against the fused regex')
+    structure.add_argument('pdf', nargs='?')
+    structure.add_argument('--pages', type=int, default=1000, help='Size of the synthetic book used when no PDF is given')
+    structure.add_argument('--repeats', type=int, default=5)
+
+    chunking = commands.add_parser('chunking', help='Chunker throughput and peak memory on a whole book')
+    chunking.add_argument('pdf', nargs='?')
+    chunking.add_argument('--pages', type=int, default=5000, help='Size of the synthetic book used when no PDF is given')
+    chunking.add_argument('--max-words', type=int, default=350)
+    chunking.add_argument('--overlap', type=int, nargs='+', default=[0, 50])
+    chunking.add_argument('--repeats', type=int, default=5)
+    chunking.add_argument('--tokens', action='store_true', help='Also compare word and token chunking against the embedding model')
+
+    args = parser.parse_args()
+
+    if args.command == 'extract': bench_extract(args.pdf, args.workers, args.repeats)
+    elif args.command == 'ann':
+        bench_ann(load_corpus(args.pdfs, args.synthetic), args.factories, args.queries, args.k, args.nprobe, args.ef_search)
+    elif args.command == 'polish':
+        bench_polish(start_stub_ollama(args.stub_latency) if args.stub else args.url, args.concurrency, args.requests)
+    elif args.command == 'embed': bench_embed(load_texts(args.pdfs), args.backends, args.queries, args.k)
+    elif args.command == 'batching': bench_batching(load_texts(args.pdfs), args.budgets, args.repeats)
+    elif args.command == 'structure':
+        bench_structure(list(main.load_pdf_pages(args.pdf)) if args.pdf else synthetic_pages(args.pages), args.repeats)
+    elif args.command == 'chunking':
+        bench_chunking(list(main.load_pdf_pages(args.pdf)) if args.pdf else synthetic_pages(args.pages), args.max_words, args.overlap, args.repeats, args.tokens)
+    elif args.command == 'startup': sys.exit(0 if bench_startup(args.repeats, args.max_seconds) else 1)
@@ -1,406 +1,1918 @@
 from pathlib import Path
-import re
-import subprocess
-from abc import ABC, abstractmethod
+import hashlib
+import json
+import http.client
+import multiprocessing
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from concurrent.futures.process import ProcessPoolExecutor
 from concurrent.futures.thread import ThreadPoolExecutor
-from typing import TypedDict, Optional
+from contextlib import asynccontextmanager, contextmanager
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+if os.name == 'nt': import msvcrt
+else: import fcntl
 
 import faiss
-from fastapi.responses import FileResponse
+import numpy as np
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Response
+from starlette.formparsers import MultiPartParser
+from starlette.requests import ClientDisconnect
 import fitz
 
+from processing import (
+    Chunk, Page, StructureDetector, chunk_detectors, chunk_in_worker, encode_in_worker, encode_texts, extract_page_range,
+    init_embed_worker, load_sentence_model, structured_chunker, timed
+)
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+    from transformers import PreTrainedTokenizerBase
+
 
 MODEL_PATH = r"C:\Users\ASUS\.hf_models\all-MiniLM-L6-v2"
 UPLOAD_DIR = Path('temp_uploads')
 UPLOAD_DIR.mkdir(exist_ok=True)
+INDEX_DIR = Path('index_store')
+INDEX_MANIFEST = INDEX_DIR / 'manifest.json'
+CACHE_DIR = Path('cache')
+
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+MAX_UPLOAD_REQUEST_BYTES = 4 * MAX_UPLOAD_BYTES  # Whole /upload/ request, all files together
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SPOOL_BYTES = 1024 * 1024  # Uploaded files larger than this are spooled to a temporary file instead of memory
+
+EMBEDDING_BACKEND = 'torch'
+ONNX_QUANTIZATION = 'avx2'
+ONNX_MODEL_DIR = CACHE_DIR / 'onnx'
+
+PDF_EXTRACT_WORKERS = 1
+PARALLEL_EXTRACT_MIN_PAGES = 64
+CHUNK_WORKERS = 1
+EMBED_BATCH_SIZE = 256
+EMBED_WORKERS = 1
+EMBED_WORKER_THREADS = 1
+EMBED_TOKEN_BUDGET = 4096
+EMBED_LENGTH_BUCKET = 32
+CHUNK_UNIT = 'tokens'  # 'tokens': size chunks with the embedding model's tokenizer; 'words': whitespace-separated words
+CHUNK_MAX_WORDS = 350
+CHUNK_OVERLAP = 50
+CHUNK_MAX_TOKENS = None  # None: the embedding model's max_seq_length, less the special tokens it adds
+CHUNK_OVERLAP_TOKENS = 32
+CHUNKER_VERSION = 4  # Bump whenever structured_chunker's output changes, so cached chunks are rebuilt.
+INDEX_FACTORY = 'Flat'
+INDEX_TRAIN_SIZE = 50_000
+INDEX_NPROBE = 16
+INDEX_EF_SEARCH = 64
+JOB_HISTORY = 100
+QUERY_BATCH_MAX_SIZE = 64
+QUERY_BATCH_MAX_WAIT_MS = 5
+QUERY_CACHE_SIZE = 10_000
+QUERY_CACHE_TTL = 3600
+POLISH_MODEL = 'llama3.2:3b'
+OLLAMA_URL = 'http://127.0.0.1:11434'
+POLISH_TIMEOUT = 30
+POLISH_WORKERS = 8
+POLISH_CACHE_SIZE = 4096
+POLISH_CACHE_PERSIST = True
+WARM_UP_QUESTION = 'Which chapter explains this topic?'
+WARM_UP_PASSAGE = ' '.join(['The chapter introduces the main ideas of the unit with worked examples.'] * 30)
+
+
+class QueryRequest(BaseModel):
+    question: str
+    polish: bool = False
+    top_k: int = 5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+
+
+def process_pool(workers: int, **kwargs) -> ProcessPoolExecutor:
+    """
+    Create a pool of `workers` processes started with `spawn`.
+    
+    Pool tasks are functions from `processing`, which workers import without running any of this module's setup, instead of forking the server with its threads, open databases and loaded model, or re-importing `main` with its index, caches and background threads in every worker.
+    
+    Parameters:
+        workers (int): Number of worker processes.
+        **kwargs: Further `ProcessPoolExecutor` arguments, e.g. `initializer`.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), **kwargs)
+
+
+def load_pdf_pages(pdf_path: str, workers: int = PDF_EXTRACT_WORKERS) -> Iterator[Page]:
+    """
+    Lazily load pages from a PDF file as Page objects.
+    
+    With `workers` greater than 1, the page range is split into contiguous slices that are extracted in a process pool and yielded in page order. Only a few slices per worker are in flight at once, so pages are not buffered ahead of the consumer. Documents shorter than `PARALLEL_EXTRACT_MIN_PAGES` are always read serially, since the pool startup would outweigh the gain.
+    
+    Parameters:
+        pdf_path (str): Filesystem path to the PDF to read.
+        workers (int): Number of worker processes used for extraction (1 reads serially in-process).
+    
+    Yields:
+        page (Page): Page dictionary containing `page_number` (1-based) and `text` (page text with surrounding whitespace removed).
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count < PARALLEL_EXTRACT_MIN_PAGES:
+            for i, page in enumerate(doc): yield {'page_number': i + 1, 'text': page.get_text('text').strip()}
+            return
+
+    # Several slices per worker keep the pool busy when page complexity is uneven.
+    step = -(-page_count // (workers * 4))
+    ranges = iter([(start, min(start + step, page_count)) for start in range(0, page_count, step)])
+
+    with process_pool(workers) as pool:
+        pending = deque(pool.submit(extract_page_range, pdf_path, start, stop) for start, stop in islice(ranges, workers * 2))
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range: pending.append(pool.submit(extract_page_range, pdf_path, *next_range))
+            yield from pages
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """
+    Group an iterable into consecutive lists of at most `size` items without materializing it.
+    
+    Parameters:
+        items (Iterable): Items to group; consumed lazily.
+        size (int): Maximum number of items per batch.
+    
+    Yields:
+        list: The next batch of items, in input order; the last batch may be shorter.
+    """
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)): yield batch
+
+
+def save_index_store(index: faiss.Index, chunks: dict[int, Chunk], version: int, next_chunk_id: int) -> None:
+    """
+    Persist a FAISS index and its chunk metadata to `INDEX_DIR` as store generation `version`.
+    
+    Each generation is written to its own files and published by atomically replacing the manifest, so processes that still have an older generation memory-mapped keep reading consistent data. Files from older generations are removed when possible; ones that are still mapped (which cannot be deleted on Windows) are retried on the next save.
+    
+    Parameters:
+        index (faiss.Index): FAISS index whose ids are keys of `chunks`.
+        chunks (dict[int, Chunk]): Chunk metadata keyed by chunk id.
+        version (int): Generation number recorded in the manifest and file names.
+        next_chunk_id (int): First chunk id not yet assigned, so ids stay unique across restarts.
+    """
+    INDEX_DIR.mkdir(exist_ok=True)
+    manifest = {
+        'version': version,
+        'next_chunk_id': next_chunk_id,
+        'index': index_file(version).name,
+        'chunks': f'chunks-{version}.json',
+        'ivf': faiss.try_extract_index_ivf(index) is not None
+    }
+
+    faiss.write_index(index, str(INDEX_DIR / manifest['index']))
+    with open(INDEX_DIR / manifest['chunks'], 'w', encoding='utf-8') as fp: json.dump(chunks, fp)
+
+    pending_manifest = INDEX_MANIFEST.with_suffix('.tmp')
+    pending_manifest.write_text(json.dumps(manifest), encoding='utf-8')
+    os.replace(pending_manifest, INDEX_MANIFEST)
+
+    for path in [*INDEX_DIR.glob('index-*.faiss'), *INDEX_DIR.glob('chunks-*.json')]:
+        if path.name in (manifest['index'], manifest['chunks']): continue
+        try: path.unlink()
+        except OSError: pass
+
+
+def index_file(version: int) -> Path:
+    """
+    Path of the FAISS index file of store generation `version`.
+    """
+    return INDEX_DIR / f'index-{version}.faiss'
+
+
+def open_index(path: Path, ivf: bool) -> faiss.Index:
+    """
+    Memory-map a saved FAISS index read-only.
+    
+    IVF indexes are opened with `IO_FLAG_MMAP`, which maps their inverted lists; all other types (flat codes, PQ, HNSW) with `IO_FLAG_MMAP_IFC`, which maps their codes and graph in place. Either way vectors are paged in from disk on demand and shared between processes serving the same store instead of being read into each process's memory. The returned index cannot be modified; use `copy_index` for a writable copy.
+    
+    Parameters:
+        path (Path): Index file written by `save_index_store`.
+        ivf (bool): Whether the index is an IVF index.
+    
+    Returns:
+        faiss.Index: The memory-mapped index.
+    """
+    return faiss.read_index(str(path), faiss.IO_FLAG_MMAP if ivf else faiss.IO_FLAG_MMAP_IFC)
+
+
+def load_index_store() -> tuple[Optional[faiss.Index], dict[int, Chunk], int, int]:
+    """
+    Load the most recently saved index generation from `INDEX_DIR`.
+    
+    The FAISS index is memory-mapped (see `open_index`).
+    
+    Returns:
+        tuple: (index, chunks, version, next_chunk_id) where `index` is the memory-mapped FAISS index, `chunks` the chunk metadata keyed by id, `version` the store generation and `next_chunk_id` the first unassigned chunk id. Returns `(None, {}, 0, 0)` if nothing has been saved yet.
+    """
+    if not INDEX_MANIFEST.exists(): return None, {}, 0, 0
+
+    manifest = json.loads(INDEX_MANIFEST.read_text(encoding='utf-8'))
+    # Manifests written before the index type was recorded: assume the configured type.
+    index = open_index(INDEX_DIR / manifest['index'], manifest.get('ivf', INDEX_FACTORY.startswith('IVF')))
+    with open(INDEX_DIR / manifest['chunks'], encoding='utf-8') as fp:
+        chunks = {int(chunk_id): chunk for chunk_id, chunk in json.load(fp).items()}
+
+    return index, chunks, manifest['version'], manifest['next_chunk_id']
+
+
+def create_index(dim: int, factory: str = INDEX_FACTORY) -> faiss.Index:
+    """
+    Create an empty inner-product index that stores vectors under explicit chunk ids.
+    
+    Parameters:
+        dim (int): Embedding dimension.
+        factory (str): FAISS index factory string, e.g. `'Flat'` (exact search), `'IVF1024,Flat'`, `'IVF1024,PQ16'` or `'HNSW32'`.
+    
+    Returns:
+        faiss.Index: IVF indexes are returned as-is since they store ids natively; other types are wrapped in `IndexIDMap2` so they support `add_with_ids`.
+    """
+    spec = factory if factory.startswith('IVF') else f'IDMap2,{factory}'
+    return faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+
+
+def copy_index(current: 'IndexSnapshot') -> faiss.Index:
+    """
+    Make an independent, modifiable copy of a published snapshot's index.
+    
+    Published indexes are read-only memory mappings of their store generation (see `open_index`), which `faiss.clone_index` cannot turn into a writable index: it would keep viewing the mapped file. The generation's file is read again without memory mapping instead.
+    
+    Parameters:
+        current (IndexSnapshot): Published snapshot with an index.
+    
+    Returns:
+        faiss.Index: An in-memory copy of `current.index`.
+    """
+    return faiss.read_index(str(index_file(current.version)))
+
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """
+    Build per-query search parameters for approximate indexes.
+    
+    Parameters:
+        index (faiss.Index): Index that will be searched.
+        nprobe (int, optional): Inverted lists visited by IVF indexes; defaults to `INDEX_NPROBE`.
+        ef_search (int, optional): Candidate list size for HNSW indexes; defaults to `INDEX_EF_SEARCH`.
+    
+    Returns:
+        faiss.SearchParameters or None: Parameters to pass to `index.search`, or `None` for exact indexes.
+    """
+    if faiss.try_extract_index_ivf(index) is not None: return faiss.SearchParametersIVF(nprobe=nprobe or INDEX_NPROBE)
+
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(base, faiss.IndexHNSW): return faiss.SearchParametersHNSW(efSearch=ef_search or INDEX_EF_SEARCH)
+    return None
+
+
+def train_size(index: faiss.Index) -> int:
+    """
+    Return the fewest vectors an untrained IVF index can be trained on: one per inverted list, and for PQ codes one per centroid of each sub-quantizer.
+    """
+    ivf = faiss.downcast_index(faiss.extract_index_ivf(index))
+    if isinstance(ivf, faiss.IndexIVFPQ): return max(ivf.nlist, ivf.pq.ksub)
+    return ivf.nlist
+
+
+class IndexWriter:
+    """
+    Adds embeddings to a FAISS index in batches, training it first when the index type requires it.
+    
+    Untrained indexes (IVF) buffer incoming vectors until `INDEX_TRAIN_SIZE` of them are available or `finish` is called, then train on the buffer and add it. A library too small to train the configured index on (fewer vectors than `train_size`) is stored in a Flat index instead; once an append brings it to `train_size` vectors, `finish` moves them out of the Flat index and trains the configured one on the whole library.
+    """
+
+    def __init__(self, index: Optional[faiss.Index] = None, factory: str = INDEX_FACTORY):
+        """
+        Parameters:
+            index (faiss.Index, optional): Index to add to; a new one is created by `create_index` on the first batch if omitted.
+            factory (str): Factory string of the index the library should be stored in.
+        """
+        self.index = index
+        self.factory = factory
+        self.pending: list[tuple[np.ndarray, np.ndarray]] = []
+        self.pending_count = 0
+
+    def add(self, embeddings: np.ndarray, chunk_ids: list[int]) -> None:
+        """
+        Add a batch of embeddings under the given chunk ids.
+        
+        Parameters:
+            embeddings (np.ndarray): float32 matrix with one row per chunk.
+            chunk_ids (list[int]): Chunk id for each row.
+        """
+        if self.index is None: self.index = create_index(embeddings.shape[1], self.factory)
+        ids = np.asarray(chunk_ids, dtype='int64')
+
+        if self.index.is_trained and not self.pending:
+            self.index.add_with_ids(embeddings, ids)
+            return
+
+        self.pending.append((embeddings, ids))
+        self.pending_count += len(ids)
+        if self.pending_count >= INDEX_TRAIN_SIZE: self.finish()
+
+    def finish(self) -> Optional[faiss.Index]:
+        """
+        Train the index on any buffered vectors if needed and add them.
+        
+        Returns:
+            faiss.Index or None: The populated index, or `None` if nothing was ever added.
+        """
+        if self.factory.startswith('IVF') and isinstance(self.index, faiss.IndexIDMap2) and isinstance(faiss.downcast_index(self.index.index), faiss.IndexFlat):
+            # A Flat stand-in for an IVF library: once there are enough vectors, queue its contents for training the configured index.
+            target = create_index(self.index.d, self.factory)
+            if self.index.ntotal + self.pending_count >= train_size(target):
+                stored = faiss.downcast_index(self.index.index).reconstruct_n(0, self.index.ntotal)
+                self.pending.insert(0, (stored, faiss.vector_to_array(self.index.id_map)))
+                self.pending_count += len(stored)
+                self.index = target
+
+        if self.pending:
+            embeddings = np.concatenate([e for e, _ in self.pending])
+            ids = np.concatenate([i for _, i in self.pending])
+            self.pending, self.pending_count = [], 0
+
+            if not self.index.is_trained:
+                if len(ids) >= train_size(self.index): self.index.train(embeddings)
+                else: self.index = create_index(self.index.d, 'Flat')
+            self.index.add_with_ids(embeddings, ids)
+        return self.index
+
+
+def rebuild_index(chunks: dict[int, Chunk], dim: int) -> faiss.Index:
+    """
+    Build a fresh index over every chunk in the store, reusing cached embeddings.
+    
+    Parameters:
+        chunks (dict[int, Chunk]): Chunk store keyed by chunk id.
+        dim (int): Embedding dimension, used when the store is empty.
+    
+    Returns:
+        faiss.Index: The new index created by `create_index`.
+    """
+    writer = IndexWriter(create_index(dim))
+    for batch in batched(chunks.items(), EMBED_BATCH_SIZE):
+        writer.add(embed_texts([c['text'] for _, c in batch]), [chunk_id for chunk_id, _ in batch])
+    return writer.finish()
+
+
+def remove_chunks(index: faiss.Index, chunks: dict[int, Chunk], chunk_ids: list[int]) -> faiss.Index:
+    """
+    Remove chunks from both the FAISS index and the chunk store.
+    
+    Parameters:
+        index (faiss.Index): Index created by `create_index`.
+        chunks (dict[int, Chunk]): Chunk store keyed by chunk id; modified in place.
+        chunk_ids (list[int]): Ids of the chunks to remove.
+    
+    Returns:
+        faiss.Index: The index holding the remaining chunks. This is `index` itself unless its type cannot delete vectors (HNSW), in which case it is rebuilt from the remaining chunks.
+    """
+    if not chunk_ids: return index
+    for chunk_id in chunk_ids: chunks.pop(chunk_id, None)
+
+    try: index.remove_ids(np.asarray(chunk_ids, dtype='int64'))
+    except RuntimeError: return rebuild_index(chunks, index.d)
+    return index
+
+
+class IndexSnapshot:
+    """
+    One published generation of the library: the FAISS index, its chunk store and the version they were saved under.
+    
+    A snapshot is never modified after it is published. Writers build a new index and chunk store on copies and publish them by rebinding the module-level `snapshot` in a single assignment (see `publish_snapshot`, and `current_snapshot` for generations saved by other processes), so a query that has read the snapshot once keeps searching a consistent index and chunk store even if an upload or deletion is published while it runs.
+    """
+
+    def __init__(self, index: Optional[faiss.Index], chunks: dict[int, Chunk], version: int, next_chunk_id: int):
+        """
+        Parameters:
+            index (Optional[faiss.Index]): Searchable index, or None before the first upload.
+            chunks (dict[int, Chunk]): Chunk metadata keyed by the ids stored in `index`.
+            version (int): Store generation; also part of the query result cache key.
+            next_chunk_id (int): First chunk id not yet assigned.
+        """
+        self.index = index
+        self.chunks = chunks
+        self.version = version
+        self.next_chunk_id = next_chunk_id
+
+    @property
+    def empty(self) -> bool:
+        """True when there is nothing to search."""
+        return self.index is None or not self.chunks
+
+
+@contextmanager
+def store_lock() -> Iterator[None]:
+    """
+    Hold an exclusive lock on `INDEX_DIR` shared by every process serving it, so uploads and deletions from different processes are applied one after another.
+    
+    The lock is an OS lock on `INDEX_DIR / 'store.lock'` and is released when the process dies. Readers never take it.
+    """
+    INDEX_DIR.mkdir(exist_ok=True)
+    with open(INDEX_DIR / 'store.lock', 'a+b') as fp:
+        if os.name == 'nt':
+            fp.seek(0)
+            # LK_LOCK gives up after about 10 seconds; keep waiting for the other process's write to finish.
+            while True:
+                try:
+                    msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: continue
+        else: fcntl.flock(fp, fcntl.LOCK_EX)
+
+        try: yield
+        finally:
+            if os.name == 'nt':
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+            else: fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def manifest_stamp() -> Optional[tuple[int, int, int]]:
+    """
+    Identify the current version of `INDEX_MANIFEST` with a single `stat` call.
+    
+    Returns:
+        tuple or None: (inode, modification time in ns, size), which changes whenever the manifest is replaced, or None if no store has been saved.
+    """
+    try: stat = os.stat(INDEX_MANIFEST)
+    except FileNotFoundError: return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def current_snapshot() -> IndexSnapshot:
+    """
+    Return the published snapshot, first loading a newer store generation if another process has saved one.
+    
+    Every process serving the same `INDEX_DIR` starts from an empty snapshot and loads the saved store on its first call; from then on uploads and deletions made through other processes replace the manifest, which is detected here by `manifest_stamp` on every call. Only when it changed is the manifest read, and a newer generation loaded and published. If that generation is itself replaced (and its files removed) while being loaded, the load is retried with the newest one.
+    
+    Returns:
+        IndexSnapshot: The newest published snapshot.
+    """
+    global snapshot, loaded_manifest
+    if manifest_stamp() == loaded_manifest: return snapshot
+
+    with snapshot_lock:
+        while (stamp := manifest_stamp()) != loaded_manifest:
+            if json.loads(INDEX_MANIFEST.read_text(encoding='utf-8'))['version'] > snapshot.version:
+                try: loaded = IndexSnapshot(*load_index_store())
+                except (OSError, RuntimeError):
+                    if manifest_stamp() != stamp: continue
+                    raise
+                if loaded.version > snapshot.version: snapshot = loaded
+            loaded_manifest = stamp
+    return snapshot
+
+
+def publish_snapshot(new: IndexSnapshot) -> None:
+    """
+    Publish a snapshot saved by this process, unless a newer generation has already been published.
+    """
+    global snapshot
+    with snapshot_lock:
+        if new.version > snapshot.version: snapshot = new
+
+
+def save_snapshot(index: faiss.Index, chunks: dict[int, Chunk], version: int, next_chunk_id: int) -> IndexSnapshot:
+    """
+    Save a new store generation with `save_index_store` and return it as a snapshot ready to publish.
+    
+    The snapshot's index is the saved file memory-mapped (see `open_index`) rather than `index` itself, so the writing process shares the pages of the new generation with every other process serving the store instead of keeping a private copy.
+    
+    Returns:
+        IndexSnapshot: The saved generation.
+    """
+    save_index_store(index, chunks, version, next_chunk_id)
+    return IndexSnapshot(open_index(index_file(version), faiss.try_extract_index_ivf(index) is not None), chunks, version, next_chunk_id)
+
+
+class IngestCache:
+    """
+    On-disk cache of extracted pages, chunks and embeddings for uploaded PDFs, backed by SQLite.
+    
+    Documents are keyed by the SHA-256 of their file bytes and embeddings by a hash of the model and chunk text, so a repeated upload skips parsing, chunking and encoding entirely, and an edited PDF only re-embeds the chunks whose text changed.
+    """
+
+    def __init__(self, path: Path):
+        """
+        Open (or create) the cache database.
+        
+        Parameters:
+            path (Path): SQLite database file; its parent directory is created if needed.
+        """
+        path.parent.mkdir(exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.executescript(
+                '''
+                CREATE TABLE IF NOT EXISTS documents (file_hash TEXT PRIMARY KEY, page_count INTEGER NOT NULL);
+                CREATE TABLE IF NOT EXISTS pages (file_hash TEXT NOT NULL, page_number INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (file_hash, page_number));
+                CREATE TABLE IF NOT EXISTS chunk_sets (chunk_key TEXT PRIMARY KEY, chunks TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS embeddings (text_hash TEXT PRIMARY KEY, vector BLOB NOT NULL);
+                '''
+            )
+
+    def get_pages(self, file_hash: str, batch_size: int = 64) -> Optional[Iterator[Page]]:
+        """
+        Look up the extracted pages of a previously parsed PDF.
+        
+        Parameters:
+            file_hash (str): SHA-256 of the PDF file bytes.
+            batch_size (int): Number of pages read from the database at a time.
+        
+        Returns:
+            Iterator[Page] or None: Lazily loaded pages in page order, or `None` if the document was never fully parsed.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT page_count FROM documents WHERE file_hash = ?', (file_hash,)).fetchone()
+        if row is None: return None
+
+        def pages() -> Iterator[Page]:
+            for start in range(1, row[0] + 1, batch_size):
+                with self.lock:
+                    rows = self.db.execute(
+                        'SELECT page_number, text FROM pages WHERE file_hash = ? AND page_number BETWEEN ? AND ? ORDER BY page_number',
+                        (file_hash, start, start + batch_size - 1)
+                    ).fetchall()
+                for page_number, text in rows: yield {'page_number': page_number, 'text': text}
+
+        return pages()
+
+    def record_pages(self, file_hash: str, pages: Iterable[Page], batch_size: int = 64) -> Iterator[Page]:
+        """
+        Pass pages through unchanged while storing them under `file_hash`.
+        
+        The document only becomes visible to `get_pages` once every page has been consumed, so an interrupted upload never leaves a partial entry behind.
+        
+        Parameters:
+            file_hash (str): SHA-256 of the PDF file bytes.
+            pages (Iterable[Page]): Pages being extracted from the PDF.
+            batch_size (int): Number of pages written to the database at a time.
+        
+        Yields:
+            Page: Each input page, in order.
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM documents WHERE file_hash = ?', (file_hash,))
+            self.db.execute('DELETE FROM pages WHERE file_hash = ?', (file_hash,))
+
+        page_count = 0
+        for batch in batched(pages, batch_size):
+            with self.lock, self.db:
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO pages VALUES (?, ?, ?)',
+                    [(file_hash, p['page_number'], p['text']) for p in batch]
+                )
+            page_count += len(batch)
+            yield from batch
+
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO documents VALUES (?, ?)', (file_hash, page_count))
+
+    def get_chunks(self, chunk_key: str) -> Optional[list[Chunk]]:
+        """
+        Look up the chunks previously produced for a document and chunker configuration.
+        
+        Parameters:
+            chunk_key (str): Key built by `chunk_cache_key`.
+        
+        Returns:
+            list[Chunk] or None: The cached chunks, or `None` on a cache miss.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT chunks FROM chunk_sets WHERE chunk_key = ?', (chunk_key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_chunks(self, chunk_key: str, chunks: list[Chunk]) -> None:
+        """
+        Store the chunks produced for a document and chunker configuration.
+        
+        Parameters:
+            chunk_key (str): Key built by `chunk_cache_key`.
+            chunks (list[Chunk]): Chunks in document order.
+        """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO chunk_sets VALUES (?, ?)', (chunk_key, json.dumps(chunks)))
+
+    def get_embeddings(self, text_hashes: list[str]) -> dict[str, np.ndarray]:
+        """
+        Look up cached embeddings by chunk text hash.
+        
+        Parameters:
+            text_hashes (list[str]): Keys built by `embedding_key`.
+        
+        Returns:
+            dict[str, np.ndarray]: float32 vectors for the hashes that were found; missing hashes are omitted.
+        """
+        if not text_hashes: return {}
+        with self.lock:
+            rows = self.db.execute(
+                f'SELECT text_hash, vector FROM embeddings WHERE text_hash IN ({",".join("?" * len(text_hashes))})',
+                text_hashes
+            ).fetchall()
+        return {text_hash: np.frombuffer(vector, dtype='float32') for text_hash, vector in rows}
+
+    def put_embeddings(self, text_hashes: list[str], vectors: np.ndarray) -> None:
+        """
+        Store embeddings by chunk text hash.
+        
+        Parameters:
+            text_hashes (list[str]): Keys built by `embedding_key`, one per row of `vectors`.
+            vectors (np.ndarray): float32 embedding matrix.
+        """
+        with self.lock, self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO embeddings VALUES (?, ?)',
+                [(text_hash, vector.tobytes()) for text_hash, vector in zip(text_hashes, vectors)]
+            )
+
+
+def chunk_cache_key(file_hash: str, detectors: list[StructureDetector], unit: str, max_size: int, overlap: int) -> str:
+    """
+    Build the cache key for the chunks of one document under one chunker configuration.
+    
+    Returns:
+        str: Key combining the file hash, detector classes, chunk unit and sizing and `CHUNKER_VERSION`, so changing any of them misses the cache. Token counts depend on the tokenizer, so in 'tokens' mode the key also includes `MODEL_PATH`.
+    """
+    if unit == 'tokens': unit = f'tokens@{MODEL_PATH}'
+    return f"{file_hash}:{','.join(type(d).__name__ for d in detectors)}:{unit}:{max_size}:{overlap}:v{CHUNKER_VERSION}"
+
+
+def load_embedder(backend: str = EMBEDDING_BACKEND) -> 'SentenceTransformer':
+    """
+    Load the embedding model at `MODEL_PATH` with the given backend (see `load_sentence_model`), keeping ONNX exports under `ONNX_MODEL_DIR`.
+    
+    Parameters:
+        backend (str): 'torch', 'onnx' or 'onnx-int8'.
+    
+    Returns:
+        SentenceTransformer: The loaded model.
+    """
+    return load_sentence_model(MODEL_PATH, backend, ONNX_MODEL_DIR, ONNX_QUANTIZATION)
+
+
+def get_embedder() -> 'SentenceTransformer':
+    """
+    Return the shared embedding model, loading it on first use.
+    
+    The server starts loading it in the background at startup (see `warm_up`); callers that arrive earlier wait for that load instead of starting another.
+    
+    Returns:
+        SentenceTransformer: The model loaded by `load_embedder`.
+    """
+    global embedder
+    if embedder is None:
+        with embedder_lock:
+            if embedder is None: embedder = load_embedder()
+    return embedder
+
+
+def embedding_key(text: str) -> str:
+    """
+    Build the cache key for the embedding of one chunk text.
+    
+    Returns:
+        str: SHA-256 of the model path, embedding backend (with `ONNX_QUANTIZATION` for 'onnx-int8') and text, so switching models, backends or quantization targets never serves stale vectors.
+    """
+    backend = f'{EMBEDDING_BACKEND}@{ONNX_QUANTIZATION}' if EMBEDDING_BACKEND == 'onnx-int8' else EMBEDDING_BACKEND
+    return hashlib.sha256(f'{MODEL_PATH}\0{backend}\0{text}'.encode('utf-8')).hexdigest()
+
+
+def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Embed chunk texts, reusing cached vectors and encoding only texts not seen before.
+    
+    Parameters:
+        texts (list[str]): Non-empty list of chunk texts.
+    
+    Returns:
+        np.ndarray: Normalized float32 embeddings, one row per text in input order.
+    """
+    keys = [embedding_key(t) for t in texts]
+    vectors = ingest_cache.get_embeddings(keys)
+    missing = [i for i, key in enumerate(keys) if key not in vectors]
+
+    if missing:
+        encoded = encode_texts(get_embedder(), [texts[i] for i in missing], EMBED_TOKEN_BUDGET, EMBED_LENGTH_BUCKET)
+        ingest_cache.put_embeddings([keys[i] for i in missing], encoded)
+        vectors.update(zip((keys[i] for i in missing), encoded))
+
+    return np.stack([vectors[key] for key in keys])
+
+
+def embed_batches(batches: Iterable[list[Chunk]], workers: int = EMBED_WORKERS, threads: int = EMBED_WORKER_THREADS) -> Iterator[tuple[list[Chunk], np.ndarray]]:
+    """
+    Embed batches of chunks, in order, optionally spreading the batches over a pool of worker processes.
+    
+    With `workers` greater than 1, each batch's uncached texts are encoded by one worker process with its own copy of the model, and up to two batches per worker are in flight at once; results are still yielded in input order, so the ids assigned by the caller line up with the chunks. Cached vectors are looked up and new ones stored in this process, as in `embed_texts`.
+    
+    Parameters:
+        batches (Iterable[list[Chunk]]): Non-empty chunk batches, e.g. from `batched`.
+        workers (int): Number of embedding processes (1 encodes in-process with `get_embedder()`).
+        threads (int): PyTorch or ONNX Runtime threads per worker process; workers times threads should not exceed the number of cores.
+    
+    Yields:
+        tuple[list[Chunk], np.ndarray]: Each batch with its normalized float32 embeddings, one row per chunk.
+    """
+    if workers <= 1:
+        for batch in batches: yield batch, embed_texts([c['text'] for c in batch])
+        return
+
+    def submit(batch: list[Chunk]) -> tuple:
+        texts = [c['text'] for c in batch]
+        keys = [embedding_key(t) for t in texts]
+        vectors = ingest_cache.get_embeddings(keys)
+        missing = [i for i, key in enumerate(keys) if key not in vectors]
+        future = pool.submit(encode_in_worker, [texts[i] for i in missing], EMBED_TOKEN_BUDGET, EMBED_LENGTH_BUCKET) if missing else None
+        return batch, keys, vectors, missing, future
+
+    with process_pool(workers, initializer=init_embed_worker, initargs=(threads, MODEL_PATH, EMBEDDING_BACKEND, ONNX_MODEL_DIR, ONNX_QUANTIZATION)) as pool:
+        batches = iter(batches)
+        pending = deque(submit(batch) for batch in islice(batches, workers * 2))
+        while pending:
+            batch, keys, vectors, missing, future = pending.popleft()
+            next_batch = next(batches, None)
+            if next_batch: pending.append(submit(next_batch))
+
+            if future is not None:
+                encoded = future.result()
+                ingest_cache.put_embeddings([keys[i] for i in missing], encoded)
+                vectors.update(zip((keys[i] for i in missing), encoded))
+            yield batch, np.stack([vectors[key] for key in keys])
+
+
+def chunk_sizing(unit: str = CHUNK_UNIT) -> tuple[Optional['PreTrainedTokenizerBase'], int, int]:
+    """
+    Resolve a chunk unit and the sizing constants into `structured_chunker` arguments.
+    
+    In 'tokens' mode chunks are sized to the embedding model, so this loads it if it is not loaded yet.
+    
+    Parameters:
+        unit (str): 'tokens' or 'words'.
+    
+    Returns:
+        tuple: (tokenizer, max_size, overlap): the embedding model's tokenizer and the chunk size and overlap in its tokens, or None and the sizes in words.
+    """
+    if unit == 'words': return None, CHUNK_MAX_WORDS, CHUNK_OVERLAP
+    if unit != 'tokens': raise ValueError(f'Unknown chunk unit: {unit}')
+
+    model = get_embedder()
+    max_tokens = CHUNK_MAX_TOKENS or model.max_seq_length - model.tokenizer.num_special_tokens_to_add()
+    return model.tokenizer, max_tokens, min(CHUNK_OVERLAP_TOKENS, max_tokens // 2)
+
+
+def chunk_pdf(pdf_path: str, file_hash: str, source_file: str, stats: Optional[dict] = None) -> Iterator[Chunk]:
+    """
+    Produce the chunks of an uploaded PDF, serving them from `ingest_cache` when the same file was processed before.
+    
+    On a chunk cache miss, pages are taken from the page cache if available (otherwise extracted and recorded), chunked, and the resulting chunks cached once the document is complete.
+    
+    Parameters:
+        pdf_path (str): Filesystem path to the saved PDF.
+        file_hash (str): SHA-256 of the PDF file bytes.
+        source_file (str): Identifier stored in each chunk's `metadata['source']`.
+        stats (Optional[dict]): If given, receives 'cached' and the seconds spent on 'parse_seconds' (reading pages) and 'chunk_seconds' (chunking them), complete once all chunks have been consumed.
+    
+    Yields:
+        Chunk: Chunks in document order.
+    """
+    if stats is None: stats = {}
+    stats.update(cached=False, parse_seconds=0.0, chunk_seconds=0.0)
+    detectors = chunk_detectors()
+    tokenizer, max_size, overlap = chunk_sizing()
+    chunk_key = chunk_cache_key(file_hash, detectors, CHUNK_UNIT, max_size, overlap)
+
+    cached = ingest_cache.get_chunks(chunk_key)
+    if cached is not None:
+        stats['cached'] = True
+        for chunk in cached:
+            chunk['metadata']['source'] = source_file
+            yield chunk
+        return
+
+    pages = ingest_cache.get_pages(file_hash)
+    if pages is None: pages = ingest_cache.record_pages(file_hash, load_pdf_pages(pdf_path))
+
+    produced: list[Chunk] = []
+    for chunk in timed(structured_chunker(timed(pages, stats, 'parse_seconds'), detectors, source_file, max_size, overlap, tokenizer), stats, 'chunk_seconds'):
+        produced.append(chunk)
+        yield chunk
+    ingest_cache.put_chunks(chunk_key, produced)
+    # Pages are read lazily from inside the chunker, so its time includes theirs.
+    stats['chunk_seconds'] -= stats['parse_seconds']
+
+
+def chunk_uploads(uploads: list[tuple[str, Path, str]], workers: int = CHUNK_WORKERS) -> Iterator[tuple[Iterator[Chunk], dict]]:
+    """
+    Produce the chunks of each uploaded file, in upload order, together with that file's stats (see `chunk_pdf`).
+    
+    With `workers` greater than 1, files whose chunks are not cached are chunked whole in a pool of worker processes (extracted there too unless their pages are cached), up to `workers` files ahead of the one being consumed, so parsing the next books overlaps with embedding the current one. Otherwise each file is chunked lazily in-process by `chunk_pdf` as its chunks are consumed.
+    
+    Parameters:
+        uploads (list[tuple[str, Path, str]]): (filename, saved path, SHA-256 of the file bytes) for each uploaded file.
+        workers (int): Number of chunking processes (1 chunks in-process).
+    
+    Yields:
+        tuple[Iterator[Chunk], dict]: Each file's chunks, and its stats, complete once the chunks have been consumed. A file that fails to parse raises when its chunks are iterated.
+    """
+    if workers <= 1:
+        for filename, path, file_hash in uploads:
+            stats = {}
+            yield chunk_pdf(str(path), file_hash, filename, stats), stats
+        return
+
+    tokenizer, max_size, overlap = chunk_sizing()
+
+    def submit(upload: tuple[str, Path, str]) -> tuple:
+        filename, path, file_hash = upload
+        chunk_key = chunk_cache_key(file_hash, chunk_detectors(), CHUNK_UNIT, max_size, overlap)
+        if ingest_cache.get_chunks(chunk_key) is not None: return upload, chunk_key, None, 0.0
+        read = {'parse_seconds': 0.0}
+        pages = ingest_cache.get_pages(file_hash)
+        if pages is not None: pages = list(timed(pages, read, 'parse_seconds'))
+        return upload, chunk_key, pool.submit(chunk_in_worker, str(path), filename, tokenizer, max_size, overlap, pages), read['parse_seconds']
+
+    def collected(file_hash: str, chunk_key: str, future: Future, read_seconds: float, stats: dict) -> Iterator[Chunk]:
+        pages, chunks, worker_stats = future.result()
+        stats.update(worker_stats)
+        stats['parse_seconds'] += read_seconds
+        if pages is not None:
+            for _ in ingest_cache.record_pages(file_hash, pages): pass
+        ingest_cache.put_chunks(chunk_key, chunks)
+        yield from chunks
+
+    with process_pool(workers) as pool:
+        uploads = iter(uploads)
+        pending = deque(submit(upload) for upload in islice(uploads, workers))
+        while pending:
+            (filename, path, file_hash), chunk_key, future, read_seconds = pending.popleft()
+            next_upload = next(uploads, None)
+            if next_upload: pending.append(submit(next_upload))
+
+            stats = {}
+            if future is None: yield chunk_pdf(str(path), file_hash, filename, stats), stats
+            else: yield collected(file_hash, chunk_key, future, read_seconds, stats), stats
+
+
+def aggregate_pages(results: list[Chunk]):
+    """
+    Compute the page range covering the provided chunks.
+    
+    Returns:
+        (start_page, end_page) (tuple[int | None, int | None]): The smallest and largest page numbers found in `results`. Returns `(None, None)` if `results` is empty.
+    """
+    if not results: return None, None
+    pages = sorted({r['metadata']['page'] for r in results})
+    return pages[0], pages[-1]
+
+
+def extract_section(results: list[Chunk]):
+    """
+    Return the single section title if all provided chunks share the same section title.
+    
+    Parameters:
+        results (list[Chunk]): Chunks whose metadata may include a 'section_title' key.
+    
+    Returns:
+        str or None: The unique section title when exactly one distinct non-empty section title is present across the chunks; otherwise `None`.
+    """
+    sections = {
+        r['metadata'].get('section_title')
+        for r in results
+        if r['metadata'].get('section_title')
+    }
+    return sections.pop() if len(sections) == 1 else None
+
+
+def build_response(results: list[Chunk]) -> str:
+    """
+    Constructs a short answer indicating which pages (and, if available, which section/topic) from the textbook are relevant to the provided search results.
+    
+    Parameters:
+        results (list[Chunk]): Chunks returned by a retrieval step; used to determine the earliest and latest page numbers and to detect a single section title.
+    
+    Returns:
+        str: A single-sentence message. If a single section title is detected, the sentence states "The topic '<section>' is discussed on pages <start>-<end> of the textbook." Otherwise, the sentence states "Relevant content for this question can be found on pages <start>-<end> of the textbook." If page information cannot be determined, the page range in the sentence will reflect that (e.g., "None-None").
+    """
+    start, end = aggregate_pages(results)
+    section = extract_section(results)
+
+    if section: return f"The topic '{section}' is discussed on pages {start}-{end} of the textbook."
+    else: return f'Relevant content for this question can be found on pages {start}-{end} of the textbook.'
+
+
+class OllamaClient:
+    """
+    Minimal client for the local Ollama HTTP API that reuses keep-alive connections across requests.
+    
+    Idle connections are kept in a pool of up to `pool_size`, so concurrent polishes each get their own connection and sequential ones skip the TCP handshake.
+    """
+
+    def __init__(self, base_url: str, pool_size: int, timeout: float):
+        """
+        Parameters:
+            base_url (str): Root URL of the Ollama server, e.g. `'http://127.0.0.1:11434'`.
+            pool_size (int): Maximum number of idle connections kept open.
+            timeout (float): Socket timeout in seconds for each request.
+        """
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self.pool: queue.LifoQueue[http.client.HTTPConnection] = queue.LifoQueue(maxsize=pool_size)
+
+    def post(self, path: str, payload: dict) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """
+        Send a JSON POST request on a pooled connection.
+        
+        A reused connection that the server has meanwhile closed is retried on a fresh connection. The caller must read the response fully and then hand the connection back with `release`.
+        
+        Parameters:
+            path (str): Request path, e.g. `'/api/generate'`.
+            payload (dict): JSON request body.
+        
+        Returns:
+            tuple: (connection, response) for the request.
+        
+        Raises:
+            OSError, http.client.HTTPException: If the server cannot be reached or the request fails.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        while True:
+            try: connection, reused = self.pool.get_nowait(), True
+            except queue.Empty: connection, reused = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout), False
+
+            try:
+                connection.request('POST', path, body, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+            except ConnectionError:
+                connection.close()
+                if reused: continue
+                raise
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                raise
+
+            return connection, response
+
+    def release(self, connection: http.client.HTTPConnection, response: http.client.HTTPResponse) -> None:
+        """
+        Return the connection of a fully read response to the pool, or close it if the pool is full or the server asked to close it.
+        """
+        if response.will_close:
+            connection.close()
+            return
+        try: self.pool.put_nowait(connection)
+        except queue.Full: connection.close()
+
+    def stream_generate(self, model: str, prompt: str) -> Iterator[str]:
+        """
+        Run a prompt through a model and yield the generated text piece by piece as the model produces it.
+        
+        Parameters:
+            model (str): Ollama model name.
+            prompt (str): Prompt text.
+        
+        Yields:
+            str: Successive fragments of the generated text.
+        
+        Raises:
+            OSError, http.client.HTTPException: If the server cannot be reached, times out or returns a non-200 status.
+            ValueError: If a streamed line is not valid JSON.
+        """
+        connection, response = self.post('/api/generate', {'model': model, 'prompt': prompt, 'stream': True})
+        finished = False
+        try:
+            if response.status != 200: raise http.client.HTTPException(f'Ollama returned HTTP {response.status}')
+            for line in response:
+                if not line.strip(): continue
+                part = json.loads(line)
+                if part.get('response'): yield part['response']
+                if part.get('done'): break
+            response.read()
+            finished = True
+        finally:
+            if finished: self.release(connection, response)
+            else: connection.close()
+
+    def generate(self, model: str, prompt: str) -> str:
+        """
+        Run a prompt through a model and return the complete generated text.
+        
+        Parameters:
+            model (str): Ollama model name.
+            prompt (str): Prompt text.
+        
+        Returns:
+            str: The generated text.
+        
+        Raises:
+            OSError, http.client.HTTPException: If the server cannot be reached, times out or returns a non-200 status.
+            ValueError: If the response body is not valid JSON.
+        """
+        connection, response = self.post('/api/generate', {'model': model, 'prompt': prompt, 'stream': False})
+        try: data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            raise
+        self.release(connection, response)
+
+        if response.status != 200: raise http.client.HTTPException(f'Ollama returned HTTP {response.status}')
+        return json.loads(data).get('response', '')
+
+
+def polish_prompt(raw_text: str) -> str:
+    """
+    Build the prompt asking the model to rephrase `raw_text`.
+    """
+    return f'Rephrase the following sentence in a clear academic tone:\n{raw_text}'
+
+
+def run_polish_model(raw_text: str) -> Optional[str]:
+    """
+    Rewrite a single sentence into a clear academic tone with the local Ollama model.
+    
+    Parameters:
+        raw_text (str): The sentence to be rephrased.
+    
+    Returns:
+        str or None: The rephrased sentence, or `None` if the Ollama server could not be reached, failed, timed out or produced no output.
+    """
+    try: return ollama.generate(POLISH_MODEL, polish_prompt(raw_text)).strip() or None
+    except (OSError, http.client.HTTPException, ValueError): return None
+
+
+def polish_sentence(raw_text: str) -> str:
+    """
+    Rewrite a single sentence into a clear academic tone.
+    
+    Attempts to rephrase `raw_text` using the local Ollama server and stores the result in `polish_cache`; if the external call fails or times out, returns the original `raw_text` unchanged (and caches nothing).
+    
+    Parameters:
+        raw_text (str): The sentence to be rephrased.
+    
+    Returns:
+        str: The rephrased sentence in a clearer academic style, or the original `raw_text` if polishing was unsuccessful.
+    """
+    polished = run_polish_model(raw_text)
+    if polished is None: return raw_text
+
+    polish_cache.put(raw_text, polished)
+    return polished
+
+
+def submit_polish(raw_text: str) -> Future:
+    """
+    Polish a sentence, answering from `polish_cache` without touching `executor` when it was polished before.
+    
+    Parameters:
+        raw_text (str): The sentence to be rephrased.
+    
+    Returns:
+        Future: Resolves to the polished sentence (or `raw_text` if polishing fails); already completed on a cache hit.
+    """
+    cached = polish_cache.get(raw_text)
+    if cached is None: return executor.submit(polish_sentence, raw_text)
+
+    future = Future()
+    future.set_result(cached)
+    return future
+
+
+def extract_sources(results: list[Chunk]) -> list[str]:
+    """
+    Return a sorted list of unique source identifiers found in chunk metadata.
+    
+    Parameters:
+        results (list[Chunk]): Chunks to scan for `metadata['source']` values.
+    
+    Returns:
+        list[str]: Sorted list of unique, non-empty source strings present in the provided chunks.
+    """
+    return sorted(
+        {
+            r['metadata'].get('source')
+            for r in results
+            if r['metadata'].get('source')
+        }
+    )
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache with an optional time-to-live and hit/miss counters.
+    """
+
+    def __init__(self, max_size: int, ttl: Optional[float] = None):
+        """
+        Parameters:
+            max_size (int): Maximum number of entries kept; the least recently used entry is evicted beyond it.
+            ttl (float, optional): Seconds an entry stays valid after it is stored; entries never expire if omitted.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Look up a key, marking it as recently used.
+        
+        Returns:
+            The cached value, or `None` if the key is missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                if entry is not None: del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        """
+        Store a value, evicting the least recently used entries if the cache is full.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size: self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Report cache occupancy and effectiveness.
+        
+        Returns:
+            dict: Contains 'size', 'max_size', 'hits', 'misses' and 'hit_rate'.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
 
 
-class Page(TypedDict):
-    page_number: int
-    text: str
+class PolishCache:
+    """
+    Cache of raw-to-polished answer sentences: an in-memory LRU in front of an optional SQLite table that survives restarts.
+    
+    Entries are keyed by `POLISH_MODEL` and the raw sentence, so switching models never serves another model's wording.
+    """
 
+    def __init__(self, max_size: int, path: Optional[Path] = None):
+        """
+        Parameters:
+            max_size (int): Maximum number of sentences kept in memory.
+            path (Path, optional): SQLite database file for the on-disk store; polished sentences are only kept in memory if omitted.
+        """
+        self.memory = LRUCache(max_size)
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+        self.db = None
+        if path is not None:
+            path.parent.mkdir(exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            with self.db: self.db.execute('CREATE TABLE IF NOT EXISTS polished (raw_key TEXT PRIMARY KEY, polished TEXT NOT NULL)')
+
+    def get(self, raw_text: str) -> Optional[str]:
+        """
+        Look up the polished version of a sentence, promoting on-disk hits into memory.
+        
+        Returns:
+            str or None: The polished sentence, or `None` if it has not been polished before.
+        """
+        key = f'{POLISH_MODEL}\0{raw_text}'
+        polished = self.memory.get(key)
+        if polished is not None or self.db is None: return polished
+
+        with self.lock:
+            row = self.db.execute('SELECT polished FROM polished WHERE raw_key = ?', (key,)).fetchone()
+            if row is None: return None
+            self.disk_hits += 1
+        self.memory.put(key, row[0])
+        return row[0]
+
+    def put(self, raw_text: str, polished: str) -> None:
+        """
+        Store the polished version of a sentence in memory and, if enabled, on disk.
+        """
+        key = f'{POLISH_MODEL}\0{raw_text}'
+        self.memory.put(key, polished)
+        if self.db is None: return
+        with self.lock, self.db: self.db.execute('INSERT OR REPLACE INTO polished VALUES (?, ?)', (key, polished))
 
-class ChunkMetadata(TypedDict):
-    page: int
-    unit: Optional[str]
-    section: Optional[str]
-    section_title: Optional[str]
-    source: Optional[str]
+    def stats(self) -> dict:
+        """
+        Report cache occupancy and effectiveness.
+        
+        Returns:
+            dict: The in-memory LRU statistics plus 'disk_hits', the memory misses served from the on-disk store.
+        """
+        with self.lock: disk_hits = self.disk_hits
+        return {**self.memory.stats(), 'disk_hits': disk_hits}
 
 
-class Chunk(TypedDict):
-    text: str
-    metadata: ChunkMetadata
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question for cache lookups by lowercasing it and collapsing whitespace.
+    
+    all-MiniLM-L6-v2 is an uncased model, so questions that differ only in case or spacing have the same embedding.
+    """
+    return ' '.join(question.lower().split())
 
 
-class QueryRequest(BaseModel):
-    question: str
-    polish: bool = False
-    top_k: int = 5
+def query_cache_key(payload: QueryRequest, version: int) -> tuple:
+    """
+    Build the result cache key for a query.
+    
+    The key includes the version of the snapshot searched, so cached results are never served once an upload or deletion has published a new index.
+    """
+    return version, normalize_question(payload.question), payload.top_k, payload.nprobe, payload.ef_search
 
 
-def load_pdf_pages(pdf_path: str) -> list[Page]:
+class QueryBatcher:
     """
-    Load pages from a PDF file as a list of Page objects.
-    
-    Parameters:
-        pdf_path (str): Filesystem path to the PDF to read.
+    Coalesces concurrent single-question queries into batched retrieval.
     
-    Returns:
-        pages (list[Page]): List of page dictionaries each containing `page_number` (1-based) and `text` (page text with surrounding whitespace removed).
+    Queries submitted from request threads are queued; a background thread collects those that arrive within `max_wait` seconds of the first one (up to `max_batch_size`), runs them through one `retrieve_chunks` call per snapshot they were submitted against, and resolves each caller's future with its own results.
     """
-    doc = fitz.open(pdf_path)
-    return [{'page_number': i + 1, 'text': page.get_text('text').strip()} for i, page in enumerate(doc)]
-
 
-class StructureDetector(ABC):
-    @abstractmethod
-    def detect(self, line: str):
+    def __init__(self, max_batch_size: int, max_wait: float):
         """
-        Detects a structural element in a single line of text.
+        Parameters:
+            max_batch_size (int): Maximum number of queries retrieved together.
+            max_wait (float): Seconds to wait for more queries after the first one of a batch arrives.
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue: queue.Queue[tuple[QueryRequest, IndexSnapshot, Future]] = queue.Queue()
+        self.lock = threading.Lock()
+        self.batch_sizes: dict[int, int] = {}
+        self.thread = threading.Thread(target=self.run, name='query-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, payload: QueryRequest, current: IndexSnapshot) -> Future:
+        """
+        Queue a query for the next batch.
+        
+        Parameters:
+            payload (QueryRequest): The query to retrieve chunks for.
+            current (IndexSnapshot): Snapshot to search.
         
         Returns:
-            dict: Extracted structure fields (for example, 'unit', 'section', or 'section_title') when the line matches a detector's pattern, `None` otherwise.
+            Future: Resolves to the list of matched chunks, or raises the retrieval error.
+        """
+        future = Future()
+        self.queue.put((payload, current, future))
+        return future
+
+    def run(self):
+        """
+        Collect and process batches forever; runs on the batcher thread.
         """
-        pass
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try: batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty: break
 
+            groups: dict[int, list[tuple[QueryRequest, IndexSnapshot, Future]]] = {}
+            for item in batch: groups.setdefault(id(item[1]), []).append(item)
 
-class UnitDetector(StructureDetector):
-    pattern = re.compile(r'^(UNIT|CHAPTER)\s+([IVXLC]+)', re.IGNORECASE)
+            for group in groups.values():
+                try:
+                    for (_, _, future), results in zip(group, retrieve_chunks([payload for payload, _, _ in group], group[0][1], use_cache=False)): future.set_result(results)
+                except Exception as e:
+                    for _, _, future in group: future.set_exception(e)
 
-    def detect(self, line: str):
+            with self.lock: self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+
+    def stats(self) -> dict:
         """
-        Detects a unit or chapter heading in a single line of text.
-        
-        Parameters:
-        	line (str): A single line of text to inspect for a leading unit/chapter heading (e.g., "UNIT I", "CHAPTER II").
+        Report the batch sizes achieved so far.
         
         Returns:
-        	dict or None: A dict with key `'unit'` whose value is the detected Roman numeral in uppercase when a heading is found, otherwise `None`.
+            dict: Contains 'batches', 'queries', 'mean_batch_size', 'max_batch_size' and 'batch_size_histogram' (batch size to number of batches).
         """
-        match = self.pattern.match(line.strip())
-        if match: return {
-            'unit': match.group(2).upper()
+        with self.lock: histogram = dict(sorted(self.batch_sizes.items()))
+        batches = sum(histogram.values())
+        queries = sum(size * count for size, count in histogram.items())
+        return {
+            'batches': batches,
+            'queries': queries,
+            'mean_batch_size': queries / batches if batches else 0.0,
+            'max_batch_size': max(histogram, default=0),
+            'batch_size_histogram': histogram
         }
-        return None
 
 
-class NumberedSectionDetector(StructureDetector):
-    pattern = re.compile(r'^(\d+(\.\d+)*)\s+(.*)')
+class IngestionJob:
+    """
+    Progress and outcome of one background upload, as reported by `/jobs/{job_id}`.
+    """
 
-    def detect(self, line: str):
+    def __init__(self, filenames: list[str]):
         """
-        Detects whether a line contains a numbered section header and extracts its section identifier and title.
-        
         Parameters:
-            line (str): A single line of text to examine for a leading numbered section (e.g., "1", "1.1", "2.3.4") followed by a title.
+            filenames (list[str]): Names of the uploaded files being ingested.
+        """
+        self.id = uuid.uuid4().hex
+        self.filenames = filenames
+        self.status = 'queued'
+        self.pages_total = 0
+        self.pages_parsed = 0
+        self.chunks_created = 0
+        self.chunks_embedded = 0
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+
+    @classmethod
+    def restore(cls, state: dict) -> 'IngestionJob':
+        """
+        Rebuild a job from the attributes saved by `JobStore.save`.
+        """
+        job = cls.__new__(cls)
+        job.__dict__.update(state)
+        return job
+
+    def eta(self) -> Optional[float]:
+        """
+        Estimate the seconds left from the page throughput so far.
         
         Returns:
-            dict: Mapping with keys 'section' (the numeric section identifier as a string) and 'section_title' (the section title) when a match is found.
-            None: If the line does not match the numbered-section pattern.
+            float or None: Estimated seconds until the job finishes, or `None` before the first pages are done or after the job has finished.
+        """
+        if self.status != 'running' or not self.pages_parsed or not self.pages_total: return None
+        elapsed = time.time() - self.started_at
+        return elapsed * (self.pages_total - self.pages_parsed) / self.pages_parsed
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: JSON-serializable view of the job: 'job_id', 'status' ('queued', 'running', 'succeeded' or 'failed'), 'files', progress counters, 'eta_seconds', 'elapsed_seconds', and 'result' or 'error' once finished.
         """
-        match = self.pattern.match(line.strip())
-        if match: return {
-            'section': match.group(1),
-            'section_title': match.group(3)
+        started = self.started_at or time.time()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'files': self.filenames,
+            'pages_total': self.pages_total,
+            'pages_parsed': self.pages_parsed,
+            'chunks_created': self.chunks_created,
+            'chunks_embedded': self.chunks_embedded,
+            'eta_seconds': self.eta(),
+            'elapsed_seconds': (self.finished_at or time.time()) - started if self.started_at else 0.0,
+            'result': self.result,
+            'error': self.error
         }
-        return None
 
 
-class StructurePipeline:
-    def __init__(self, detectors: list[StructureDetector]):
+class JobStore:
+    """
+    Upload jobs shared by every server process, backed by SQLite.
+    
+    The process running a job saves it as it progresses, so `/jobs/{job_id}` can be answered by whichever process receives the poll. Only the newest `JOB_HISTORY` finished jobs are kept.
+    """
+
+    def __init__(self, path: Path, history: int):
         """
-        Initialize a StructurePipeline with the given detectors and reset internal structure state.
+        Open (or create) the job database.
         
         Parameters:
-            detectors (list[StructureDetector]): Ordered list of detector instances used to inspect lines and update pipeline state (unit, section, section_title).
+            path (Path): SQLite database file; its parent directory is created if needed.
+            history (int): Number of finished jobs to keep.
         """
-        self.detectors = detectors
-        self.state = {
-            'unit': None,
-            'section': None,
-            'section_title': None,
-        }
+        path.parent.mkdir(exist_ok=True)
+        self.history = history
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db: self.db.execute('CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, created_at REAL NOT NULL, finished INTEGER NOT NULL, state TEXT NOT NULL)')
 
-    def process_line(self, line: str):
+    def save(self, job: IngestionJob) -> None:
+        """
+        Record the current state of a job, and drop the oldest finished jobs beyond `history`.
+        """
+        finished = job.status in ('succeeded', 'failed')
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?)', (job.id, job.created_at, finished, json.dumps(vars(job))))
+            if finished:
+                self.db.execute('DELETE FROM jobs WHERE finished AND job_id NOT IN (SELECT job_id FROM jobs WHERE finished ORDER BY created_at DESC LIMIT ?)', (self.history,))
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
         """
-        Update the pipeline state by running each detector against a single line.
-        
-        Parameters:
-            line (str): A single line of text to be examined by the configured detectors.
-        
         Returns:
-            tuple: (updated, state) where:
-                updated (bool): True if any detector produced an update to the pipeline state, False otherwise.
-                state (dict): A shallow copy of the pipeline's current state (for example: unit, section, section_title).
+            IngestionJob or None: The job as last saved by any process, or `None` if the id is unknown.
         """
-        updated = False
-        for detector in self.detectors:
-            result = detector.detect(line)
-            if result:
-                self.state.update(result)
-                updated = True
-        return updated, self.state.copy()
+        with self.lock:
+            row = self.db.execute('SELECT state FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return IngestionJob.restore(json.loads(row[0])) if row else None
 
 
-def structured_chunker(pages: list[Page], detectors: list[StructureDetector], source_file: str, max_words: int = 350, overlap: int = 50) -> list[Chunk]:
+def warm_up():
     """
-    Split OCR/extracted PDF pages into text chunks while preserving detected structural metadata.
-    
-    Parameters:
-        pages (list[Page]): Sequence of pages with 1-based `page_number` and extracted `text`.
-        detectors (list[StructureDetector]): Structural detectors used to update per-line unit/section/section_title state.
-        source_file (str): Identifier stored in each chunk's `metadata['source']`.
-        max_words (int): Target maximum number of words per chunk before flushing.
-        overlap (int): Number of trailing words to retain when creating the next chunk (0 disables overlap).
+    Load the embedding model and run representative calls in the background, so the first user request does not pay for them.
     
-    Returns:
-        list[Chunk]: Ordered list of chunks where each chunk is a dict with:
-            - `text`: concatenated chunk text (str).
-            - `metadata`: dict containing `page` (int), `source` (str) and any detected `unit`, `section`, and `section_title`.
+    After loading, a question and a chunk-length passage are encoded (the first forward passes allocate and tune the model's buffers) and the question is searched in the current index, which also pages a memory-mapped index in from disk. Results are discarded; the query caches are not touched. `/readyz` reports ready once this has finished.
     """
-    pipeline = StructurePipeline(detectors)
-    chunks: list[Chunk] = []
+    global model_status, warm_up_error
+    try:
+        model = get_embedder()
+        model_status = 'warming'
+        model.encode([WARM_UP_PASSAGE] * 4, normalize_embeddings=True)
+        vector = model.encode([WARM_UP_QUESTION], normalize_embeddings=True).astype('float32')
 
-    buffer: list[str] = []
-    current_metadata: ChunkMetadata = {}
-    last_structure = None
+        current = current_snapshot()
+        if not current.empty: current.index.search(vector, 5, params=search_parameters(current.index))
+        model_status = 'ready'
+    except Exception as e:
+        warm_up_error = str(e)
+        model_status = 'failed'
 
-    def flush(page_number: int, force_reset: bool = False):
-        """
-        Flushes the current word buffer into a new chunk with page and source metadata and appends it to the enclosing `chunks` list.
-        
-        If the buffer is empty this function does nothing. After creating the chunk, the buffer is cleared; if `force_reset` is False and a nonzero `overlap` is defined in the enclosing scope, the last `overlap` words are preserved in the buffer for the next chunk.
-        Parameters:
-            page_number (int): Page number to record in the chunk metadata.
-            force_reset (bool): If True, clear the buffer completely after flushing; otherwise retain up to `overlap` trailing words.
-        """
-        nonlocal buffer
-        if not buffer: return
-        chunks.append(
-            {
-                'text':' '.join(buffer).strip(),
-                'metadata': {
-                    'page': page_number,
-                    'source': source_file,
-                    **current_metadata
-                }
-            }
-        )
 
-        if force_reset or overlap == 0: buffer = []
-        else: buffer = buffer[-overlap:]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Start the background warm-up when the server starts; importing the module alone loads no model.
+    """
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    yield
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware that rejects requests to one path whose body is larger than a limit, before the body is parsed and spooled.
+    
+    Starlette parses a multipart upload completely, spooling every file, before the endpoint runs, so a size check in the endpoint only sees an oversized upload after it has been written out. Here a declared `Content-Length` over the limit is answered with 413 without reading the body, and a body sent without one (chunked) is cut off as soon as it passes the limit.
+    """
 
-    for page in pages:
-        page_number = page['page_number']
+    def __init__(self, app, path: str, max_bytes: int):
+        """
+        Parameters:
+            app: The ASGI application to wrap.
+            path (str): Request path the limit applies to, e.g. `'/upload/'`.
+            max_bytes (int): Largest accepted request body, in bytes.
+        """
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path: return await self.app(scope, receive, send)
+
+        length = dict(scope['headers']).get(b'content-length', b'')
+        if length.isdigit() and int(length) > self.max_bytes: return await self.reject(send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive() -> dict:
+            # Past the limit, report a disconnect: the form parser stops reading and the request fails.
+            nonlocal received, exceeded
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    exceeded = True
+                    return {'type': 'http.disconnect'}
+            return message
+
+        async def guarded_send(message: dict):
+            # The app's own error response for the aborted body is replaced by the 413.
+            if not exceeded: await send(message)
+
+        try: await self.app(scope, limited_receive, guarded_send)
+        except ClientDisconnect:
+            if not exceeded: raise
+        if exceeded: await self.reject(send)
+
+    async def reject(self, send):
+        """
+        Send a 413 response with the same `{'error': ...}` body as other rejected uploads.
+        """
+        body = json.dumps({'error': f'The upload is larger than the {self.max_bytes // (1024 * 1024)} MB request limit.'}).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 413, 'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode('ascii')), (b'connection', b'close')]})
+        await send({'type': 'http.response.body', 'body': body})
 
-        for line in page['text'].splitlines():
-            line = line.strip()
-            if not line: continue
 
-            structure_changed, state = pipeline.process_line(line)
-            new_structure = (
-                state.get('unit'),
-                state.get('section'),
-                state.get('section_title')
-            )
+app = FastAPI(title='Text Book Assistant', lifespan=lifespan)
+app.add_middleware(RequestSizeLimit, path='/upload/', max_bytes=MAX_UPLOAD_REQUEST_BYTES)
+# Starlette keeps each uploaded file in memory up to this size before moving it to a temporary file; it has no per-app setting.
+MultiPartParser.spool_max_size = UPLOAD_SPOOL_BYTES
 
-            if structure_changed and new_structure != last_structure:
-                flush(page_number, force_reset=True)
-                current_metadata = {
-                    'unit': state['unit'],
-                    'section': state['section'],
-                    'section_title': state['section_title'],
-                }
-                last_structure = new_structure
+executor = ThreadPoolExecutor(max_workers=POLISH_WORKERS)
+ollama = OllamaClient(OLLAMA_URL, POLISH_WORKERS, POLISH_TIMEOUT)
 
-            buffer.extend(line.split())
+query_batcher = QueryBatcher(QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS / 1000)
+query_embedding_cache = LRUCache(QUERY_CACHE_SIZE)
+query_result_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+polish_cache = PolishCache(POLISH_CACHE_SIZE, CACHE_DIR / 'polish.sqlite3' if POLISH_CACHE_PERSIST else None)
 
-            if len(buffer) >= max_words: flush(page_number)
+embedder: Optional['SentenceTransformer'] = None
+embedder_lock = threading.Lock()
+model_status = 'loading'
+warm_up_error: Optional[str] = None
 
-        flush(page_number)
+ingest_cache = IngestCache(CACHE_DIR / 'ingest.sqlite3')
 
-    return chunks
+snapshot = IndexSnapshot(None, {}, 0, 0)
+snapshot_lock = threading.Lock()
+loaded_manifest: Optional[tuple[int, int, int]] = None
 
+ingest_executor = ThreadPoolExecutor(max_workers=1)
+index_write_lock = threading.Lock()
+jobs = JobStore(CACHE_DIR / 'jobs.sqlite3', JOB_HISTORY)
 
-def aggregate_pages(results: list[Chunk]):
+@app.get('/')
+def serve_frontend():
     """
-    Compute the page range covering the provided chunks.
+    Serve the frontend application's entry HTML file.
     
     Returns:
-        (start_page, end_page) (tuple[int | None, int | None]): The smallest and largest page numbers found in `results`. Returns `(None, None)` if `results` is empty.
+        FileResponse: Response serving the frontend's `frontend/index.html` file.
     """
-    if not results: return None, None
-    pages = sorted({r['metadata']['page'] for r in results})
-    return pages[0], pages[-1]
+    return FileResponse('frontend/index.html')
 
+def run_ingestion(job: IngestionJob, upload_dir: Path, uploads: list[tuple[str, Path, str]], append: bool):
+    """
+    Chunk, embed and index uploaded PDFs for a background job, then publish the result.
+    
+    Ingestion is streamed: pages are read lazily, chunks are produced incrementally, and embeddings are computed (see `embed_batches`) and added `EMBED_BATCH_SIZE` chunks at a time, so peak memory does not grow with the size of the book. Files seen before are served from `ingest_cache`. With `CHUNK_WORKERS` above 1, later files are parsed and chunked in worker processes while earlier ones are embedded (see `chunk_uploads`); per-file counts and timings are reported in the result's 'file_stats'.
+    
+    The job works on a copy of the current snapshot while queries keep searching the published one, and publishes the finished copy as a new `IndexSnapshot` at the end; a failed job leaves the library unchanged. In append mode, chunks previously indexed from a file with the same name are replaced. Jobs and deletions modify the library one at a time under `index_write_lock` and `store_lock`, each starting from the newest generation saved by any process.
+    
+    Parameters:
+        job (IngestionJob): Job record updated with progress and outcome.
+        upload_dir (Path): Directory holding the job's saved files; removed when the job ends.
+        uploads (list[tuple[str, Path, str]]): (filename, saved path, SHA-256 of the file bytes) for each uploaded file.
+        append (bool): Add to the existing library when True; replace the whole library when False.
+    """
+    job.status = 'running'
+    job.started_at = time.time()
+    jobs.save(job)
+    try:
+        page_counts = []
+        for filename, path, _ in uploads:
+            try:
+                with fitz.open(path) as doc: page_counts.append(doc.page_count)
+            except Exception as e: raise RuntimeError(f'Failed to process {filename}: {str(e)}') from e
+        job.pages_total = sum(page_counts)
+        jobs.save(job)
+
+        with index_write_lock, store_lock():
+            base = current_snapshot()
+            target_chunks: dict[int, Chunk] = dict(base.chunks) if append else {}
+            writer = IndexWriter(copy_index(base) if append and base.index is not None else None)
+            next_chunk_id = base.next_chunk_id
+            added = 0
+
+            filenames = {filename for filename, _, _ in uploads}
+            stale_ids = [i for i, c in target_chunks.items() if c['metadata'].get('source') in filenames]
+
+            file_stats = []
+
+            def produced() -> Iterator[list[Chunk]]:
+                pages_done = 0
+                for (filename, _, _), page_count, (chunks, stats) in zip(uploads, page_counts, chunk_uploads(uploads)):
+                    file_chunks = 0
+                    try:
+                        for batch in batched(chunks, EMBED_BATCH_SIZE):
+                            file_chunks += len(batch)
+                            job.chunks_created += len(batch)
+                            job.pages_parsed = pages_done + batch[-1]['metadata']['page']
+                            yield batch
+                    except Exception as e: raise RuntimeError(f'Failed to process {filename}: {str(e)}') from e
+                    pages_done += page_count
+                    job.pages_parsed = pages_done
+                    file_stats.append({'file': filename, 'pages': page_count, 'chunks': file_chunks, **stats})
+
+            for batch, embeddings in embed_batches(produced()):
+                ids = list(range(next_chunk_id, next_chunk_id + len(batch)))
+                next_chunk_id += len(batch)
+
+                writer.add(embeddings, ids)
+                target_chunks.update(zip(ids, batch))
+                added += len(batch)
+                job.chunks_embedded += len(batch)
+                jobs.save(job)
+
+            if not added: raise RuntimeError('No valid PDF pages found.')
+
+            try: target_index = writer.finish()
+            except RuntimeError as e: raise RuntimeError(f'Failed to build the index: {str(e)}') from e
+            target_index = remove_chunks(target_index, target_chunks, stale_ids)
+
+            publish_snapshot(save_snapshot(target_index, target_chunks, base.version + 1, next_chunk_id))
+
+        job.result = {
+            'files_indexed': job.filenames,
+            'chunks_created': added,
+            'chunks_replaced': len(stale_ids),
+            'total_chunks': len(target_chunks),
+            'file_stats': file_stats
+        }
+        job.status = 'succeeded'
+    except Exception as e:
+        job.error = str(e)
+        job.status = 'failed'
+    finally:
+        job.finished_at = time.time()
+        jobs.save(job)
+        shutil.rmtree(upload_dir, ignore_errors=True)
 
-def extract_section(results: list[Chunk]):
+
+def save_upload(file: UploadFile, path: Path) -> str:
     """
-    Return the single section title if all provided chunks share the same section title.
+    Stream an uploaded file to disk `UPLOAD_CHUNK_SIZE` bytes at a time, hashing it on the way.
+    
+    Only one chunk of the file is held in memory at a time, whatever its size.
     
     Parameters:
-        results (list[Chunk]): Chunks whose metadata may include a 'section_title' key.
+        file (UploadFile): The uploaded file.
+        path (Path): Destination path; its parent directory must exist.
     
     Returns:
-        str or None: The unique section title when exactly one distinct non-empty section title is present across the chunks; otherwise `None`.
+        str: SHA-256 of the file bytes.
+    
+    Raises:
+        ValueError: If the file is larger than `MAX_UPLOAD_BYTES`. The partially written file is left for the caller to remove.
     """
-    sections = {
-        r['metadata'].get('section_title')
-        for r in results
-        if r['metadata'].get('section_title')
-    }
-    return sections.pop() if len(sections) == 1 else None
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'wb') as fp:
+        for block in iter(lambda: file.file.read(UPLOAD_CHUNK_SIZE), b''):
+            size += len(block)
+            if size > MAX_UPLOAD_BYTES: raise ValueError(f'{file.filename} is larger than the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit.')
+            digest.update(block)
+            fp.write(block)
+    return digest.hexdigest()
 
 
-def build_response(results: list[Chunk]) -> str:
+@app.post('/upload/')
+def upload_pdf(files: list[UploadFile] = File(...), append: bool = True):
     """
-    Constructs a short answer indicating which pages (and, if available, which section/topic) from the textbook are relevant to the provided search results.
+    Save uploaded PDF files and queue a background job that chunks, embeds and indexes them.
+    
+    The request returns as soon as the files are on disk; progress is reported by `/jobs/{job_id}` and the new snapshot is published when the job finishes (see `run_ingestion`).
     
     Parameters:
-        results (list[Chunk]): Chunks returned by a retrieval step; used to determine the earliest and latest page numbers and to detect a single section title.
+        files (list[UploadFile]): Uploaded PDF files to be saved, parsed, chunked, and indexed.
+        append (bool): Add to the existing library when True; replace the whole library with these files when False.
     
     Returns:
-        str: A single-sentence message. If a single section title is detected, the sentence states "The topic '<section>' is discussed on pages <start>-<end> of the textbook." Otherwise, the sentence states "Relevant content for this question can be found on pages <start>-<end> of the textbook." If page information cannot be determined, the page range in the sentence will reflect that (e.g., "None-None").
+        dict: Contains:
+            - 'status' (str): 'queued'
+            - 'job_id' (str): id to poll at `/jobs/{job_id}`
+            If a file exceeds `MAX_UPLOAD_BYTES`, contains 'error' instead and nothing is queued.
     """
-    start, end = aggregate_pages(results)
-    section = extract_section(results)
+    job = IngestionJob([f.filename for f in files])
+    upload_dir = UPLOAD_DIR / job.id
 
-    if section: return f"The topic '{section}' is discussed on pages {start}-{end} of the textbook."
-    else: return f'Relevant content for this question can be found on pages {start}-{end} of the textbook.'
+    uploads: list[tuple[str, Path, str]] = []
+    for file in files:
+        file_path = upload_dir / str(len(uploads)) / Path(file.filename).name
+        file_path.parent.mkdir(parents=True)
+        try: file_hash = save_upload(file, file_path)
+        except ValueError as e:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            return {'error': str(e)}
+        uploads.append((file.filename, file_path, file_hash))
 
+    jobs.save(job)
 
-def polish_sentence(raw_text: str) -> str:
+    ingest_executor.submit(run_ingestion, job, upload_dir, uploads, append)
+
+    return {
+        'status': 'queued',
+        'job_id': job.id
+    }
+
+
+@app.get('/jobs/{job_id}')
+def get_job(job_id: str):
     """
-    Rewrite a single sentence into a clear academic tone.
-    
-    Attempts to rephrase `raw_text` using an external Ollama model; if the external call fails or times out, returns the original `raw_text` unchanged.
+    Report the progress of an upload job.
     
     Parameters:
-        raw_text (str): The sentence to be rephrased.
+        job_id (str): Id returned by `/upload/`.
     
     Returns:
-        str: The rephrased sentence in a clearer academic style, or the original `raw_text` if polishing was unsuccessful.
+        dict: The job as described by `IngestionJob.to_dict`, or a dict with 'error' if the id is unknown.
     """
-    prompt = f'Rephrase the following sentence in a clear academic tone:\n{raw_text}'
+    job = jobs.get(job_id)
+    if job is None: return {'error': f'Unknown job {job_id}.'}
+    return job.to_dict()
 
-    try:
-        result = subprocess.run(
-            [
-                'ollama', 'run', 'llama3.2:3b'
-            ],
-            input=prompt,
-            text=True,
-            encoding='utf-8',
-            errors='ignore',
-            capture_output=True,
-            timeout=30
-        )
-        if result.returncode != 0: return raw_text
-        return result.stdout.strip()
-    except (FileNotFoundError, subprocess.TimeoutExpired): return raw_text
 
+@app.get('/sources/')
+def list_sources():
+    """
+    List the source files currently in the index.
+    
+    Returns:
+        dict: Contains 'sources', a mapping of source filename to the number of indexed chunks from that file.
+    """
+    counts: dict[str, int] = {}
+    for c in current_snapshot().chunks.values():
+        source = c['metadata'].get('source')
+        counts[source] = counts.get(source, 0) + 1
+    return {'sources': counts}
 
-def extract_sources(results: list[Chunk]) -> list[str]:
+
+@app.delete('/sources/{source:path}')
+def delete_source(source: str):
     """
-    Return a sorted list of unique source identifiers found in chunk metadata.
+    Remove every chunk indexed from one source file and persist the updated index.
+    
+    Like uploads, the removal is applied to a copy of the current snapshot that is published once complete.
     
     Parameters:
-        results (list[Chunk]): Chunks to scan for `metadata['source']` values.
+        source (str): Filename the chunks were uploaded from.
     
     Returns:
-        list[str]: Sorted list of unique, non-empty source strings present in the provided chunks.
+        dict: On success, contains 'status', 'source' and 'chunks_removed'. If nothing is indexed for `source`, contains 'error'.
     """
-    return sorted(
-        {
-            r['metadata'].get('source')
-            for r in results
-            if r['metadata'].get('source')
-        }
-    )
+    with index_write_lock, store_lock():
+        base = current_snapshot()
+        stale_ids = [i for i, c in base.chunks.items() if c['metadata'].get('source') == source]
+        if not stale_ids: return {'error': f'No indexed content found for {source}.'}
 
-app = FastAPI(title='Text Book Assistant')
+        target_chunks = dict(base.chunks)
+        target_index = remove_chunks(copy_index(base), target_chunks, stale_ids)
 
-executor = ThreadPoolExecutor(max_workers=2)
+        publish_snapshot(save_snapshot(target_index, target_chunks, base.version + 1, base.next_chunk_id))
 
-embedder = SentenceTransformer(MODEL_PATH, device='cpu')
-chunks: list[Chunk] = []
+    return {
+        'status': 'success',
+        'source': source,
+        'chunks_removed': len(stale_ids)
+    }
 
-index = None
 
-@app.get('/')
-def serve_frontend():
+def retrieve_chunks(payloads: list[QueryRequest], current: IndexSnapshot, use_cache: bool = True) -> list[list[Chunk]]:
     """
-    Serve the frontend application's entry HTML file.
+    Retrieve the top matching chunks for several questions at once.
+    
+    Questions found in `query_result_cache` are answered without embedding or searching. The remaining questions reuse embeddings from `query_embedding_cache` where possible and are otherwise embedded in a single `encode` call; questions sharing the same search parameters are then answered by a single multi-vector `index.search` at their largest `top_k`, trimmed to each question's own `top_k`, and cached.
+    
+    Parameters:
+        payloads (list[QueryRequest]): Questions with their `top_k` and optional `nprobe`/`ef_search` settings.
+        current (IndexSnapshot): Snapshot to search; every question is answered from this one snapshot.
+        use_cache (bool): Look up `query_result_cache` first; callers that already checked it pass False.
     
     Returns:
-        FileResponse: Response serving the frontend's `frontend/index.html` file.
+        list[list[Chunk]]: Matched chunks for each payload, best match first, in the same order as `payloads`.
     """
-    return FileResponse('frontend/index.html')
-
-@app.post('/upload/')
-def upload_pdf(files: list[UploadFile] = File(...)):
+    results: list[Optional[list[Chunk]]] = [query_result_cache.get(query_cache_key(p, current.version)) if use_cache else None for p in payloads]
+    misses = [position for position, r in enumerate(results) if r is None]
+    if not misses: return results
+
+    questions = [normalize_question(payloads[p].question) for p in misses]
+    vectors = {}
+    for question in dict.fromkeys(questions):
+        vector = query_embedding_cache.get(question)
+        if vector is not None: vectors[question] = vector
+
+    to_encode = [q for q in dict.fromkeys(questions) if q not in vectors]
+    if to_encode:
+        encoded = get_embedder().encode(
+            to_encode,
+            normalize_embeddings=True
+        ).astype('float32')
+        for question, vector in zip(to_encode, encoded):
+            query_embedding_cache.put(question, vector)
+            vectors[question] = vector
+
+    q_emb = np.stack([vectors[q] for q in questions])
+
+    groups: dict[tuple[Optional[int], Optional[int]], list[int]] = {}
+    for row, position in enumerate(misses):
+        payload = payloads[position]
+        groups.setdefault((payload.nprobe, payload.ef_search), []).append(row)
+
+    for (nprobe, ef_search), rows in groups.items():
+        top_k = max(payloads[misses[r]].top_k for r in rows)
+        scores, indices = current.index.search(q_emb[rows], top_k, params=search_parameters(current.index, nprobe, ef_search))
+        for row, found in zip(rows, indices.tolist()):
+            payload = payloads[misses[row]]
+            results[misses[row]] = [current.chunks[i] for i in found[:payload.top_k] if i in current.chunks]
+            query_result_cache.put(query_cache_key(payload, current.version), results[misses[row]])
+
+    return results
+
+
+def find_chunks(payload: QueryRequest, current: IndexSnapshot) -> list[Chunk]:
     """
-    Process uploaded PDF files into structured text chunks, compute embeddings, and build an in-memory FAISS index.
+    Retrieve the chunks for a single question, from `query_result_cache` when possible and otherwise through `query_batcher`.
     
     Parameters:
-        files (list[UploadFile]): Uploaded PDF files to be saved, parsed, chunked, and indexed.
+        payload (QueryRequest): The question and its search settings.
+        current (IndexSnapshot): Snapshot to search.
     
     Returns:
-        dict: On success, contains:
-            - 'status' (str): 'success'
-            - 'files_indexed' (list[str]): filenames that were indexed
-            - 'chunks_created' (int): number of text chunks produced and indexed
-        On failure, contains:
-            - 'error' (str): descriptive error message explaining the failure
+        list[Chunk]: Matched chunks, best match first.
     """
-    global chunks, index
+    results = query_result_cache.get(query_cache_key(payload, current.version))
+    if results is None: results = query_batcher.submit(payload, current).result()
+    return results
 
-    all_chunks: list[Page] = []
 
-    for file in files:
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, 'wb') as fp: fp.write(file.file.read())
-        try:
-            pages = load_pdf_pages(str(file_path))
-            pdf_chunks = structured_chunker(
-                pages,
-                [
-                    UnitDetector(),
-                    NumberedSectionDetector()
-                ],
-                file.filename
-            )
-            all_chunks.extend(pdf_chunks)
-        except Exception as e: return {'error': f'Failed to process {file.filename}: {str(e)}'}
+def sse_event(event: str, data: dict) -> str:
+    """
+    Format one Server-Sent Events message.
+    
+    Parameters:
+        event (str): Event name.
+        data (dict): Payload, sent as JSON.
+    
+    Returns:
+        str: The encoded event, terminated by a blank line.
+    """
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
 
-    if not all_chunks: return {'error': 'No valid PDF pages found.'}
 
-    chunks = all_chunks
+def stream_polish(raw_text: str) -> Iterator[str]:
+    """
+    Polish a sentence while yielding the text as it is generated.
+    
+    A previously polished sentence is yielded whole from `polish_cache`; a newly completed polish is stored in the cache.
+    
+    Parameters:
+        raw_text (str): The sentence to be rephrased.
+    
+    Yields:
+        str: Successive fragments of the polished sentence.
+    
+    Raises:
+        OSError, http.client.HTTPException, ValueError: If the model cannot be reached or fails part-way, possibly after some fragments were yielded.
+    """
+    cached = polish_cache.get(raw_text)
+    if cached is not None:
+        yield cached
+        return
 
-    texts = [c['text'] for c in chunks]
+    parts: list[str] = []
+    for part in ollama.stream_generate(POLISH_MODEL, polish_prompt(raw_text)):
+        parts.append(part)
+        yield part
 
-    embeddings = embedder.encode(
-        texts,
-        normalize_embeddings=True
-    ).astype('float32')
+    polished = ''.join(parts).strip()
+    if polished: polish_cache.put(raw_text, polished)
 
-    if embeddings.size == 0: return {'error': 'No text content found in PDF.'}
 
-    index = faiss.IndexFlatIP(embeddings.shape[1])
-    index.add(embeddings)
+def format_answer(question: str, results: list[Chunk], answer: str) -> dict:
+    """
+    Assemble the response for one question.
+    
+    Parameters:
+        question (str): The original question.
+        results (list[Chunk]): Chunks retrieved for the question.
+        answer (str): The raw or polished answer sentence.
+    
+    Returns:
+        dict: Contains 'question', 'answer', 'page_range' ("start-end") and 'sources'.
+    """
+    start, end = aggregate_pages(results)
 
-    for file in files:
-        file_path = UPLOAD_DIR / file.filename
-        if file_path: file_path.unlink()
+    sources = extract_sources(results)
 
     return {
-        'status': 'success',
-        'files_indexed': [f.filename for f in files],
-        'chunks_created': len(chunks)
+        'question': question,
+        'answer': answer,
+        'page_range': f'{start}-{end}',
+        'sources': sources
     }
 
 
@@ -409,8 +1921,10 @@ def query_textbook(payload: QueryRequest):
     """
     Handle a query against the currently indexed PDF chunks and return a concise answer with provenance.
     
+    Repeated questions are answered from `query_result_cache`; other retrievals go through `query_batcher`, so concurrent requests are embedded and searched together.
+    
     Parameters:
-        payload (QueryRequest): Query payload containing the question text, whether to polish the answer, and the number of top results to retrieve.
+        payload (QueryRequest): Query payload containing the question text, whether to polish the answer, the number of top results to retrieve, and optional `nprobe`/`ef_search` overrides for approximate indexes.
     
     Returns:
         dict: A response object with the following keys:
@@ -420,31 +1934,158 @@ def query_textbook(payload: QueryRequest):
             - "sources": a list of source identifiers present in the matched chunks.
     
     """
-    if index is None or not chunks: return {'error': 'No PDF indexed. Please upload a PDF first.'}
+    current = current_snapshot()
+    if current.empty: return {'error': 'No PDF indexed. Please upload a PDF first.'}
 
-    q_emb = embedder.encode(
-        [payload.question],
-        normalize_embeddings=True
-    ).astype('float32')
-
-    scores, indices = index.search(q_emb, payload.top_k)
-
-    results = [chunks[i] for i in indices[0] if 0 <= i < len(chunks)]
+    results = find_chunks(payload, current)
 
     raw_answer = build_response(results)
 
     if payload.polish:
-        future = executor.submit(polish_sentence, raw_answer)
+        future = submit_polish(raw_answer)
         final_answer = future.result()
     else: final_answer = raw_answer
 
-    start, end = aggregate_pages(results)
+    return format_answer(payload.question, results, final_answer)
 
-    sources = extract_sources(results)
 
+@app.get('/stats')
+def get_stats():
+    """
+    Report runtime statistics for the query path.
+    
+    Returns:
+        dict: Contains 'query_batching', the batch sizes achieved by `query_batcher`, and 'query_cache' and 'polish_cache', the occupancy and hit/miss counters of the query embedding, result and polished sentence caches.
+    """
     return {
-        'question': payload.question,
-        'answer': final_answer,
-        'page_range': f'{start}-{end}',
-        'sources': sources
-    }
\ No newline at end of file
+        'query_batching': query_batcher.stats(),
+        'query_cache': {
+            'embeddings': query_embedding_cache.stats(),
+            'results': query_result_cache.stats()
+        },
+        'polish_cache': polish_cache.stats()
+    }
+
+
+def service_status() -> dict:
+    """
+    Describe the model and index state reported by `/healthz` and `/readyz`.
+    
+    Returns:
+        dict: Contains 'model' ('loading', 'warming', 'ready' or 'failed'), 'index_version', 'index_size' (vectors in the index), 'chunks' and, if warm-up failed, 'error'.
+    """
+    current = current_snapshot()
+    status = {
+        'model': model_status,
+        'index_version': current.version,
+        'index_size': current.index.ntotal if current.index is not None else 0,
+        'chunks': len(current.chunks)
+    }
+    if warm_up_error is not None: status['error'] = warm_up_error
+    return status
+
+
+@app.get('/healthz')
+def healthz():
+    """
+    Liveness check: answers as long as the process is serving requests, whatever the model state.
+    
+    Returns:
+        dict: 'status' ('ok') plus the fields of `service_status`.
+    """
+    return {'status': 'ok', **service_status()}
+
+
+@app.get('/readyz')
+def readyz(response: Response):
+    """
+    Readiness check: whether queries are answered at full speed, i.e. the model is loaded and warm-up has run.
+    
+    Parameters:
+        response (Response): Used to set the status code: 200 when ready, 503 while loading or warming up, or if warm-up failed.
+    
+    Returns:
+        dict: 'status' ('ready' or 'not ready') plus the fields of `service_status`.
+    """
+    status = service_status()
+    if status['model'] == 'ready': return {'status': 'ready', **status}
+
+    response.status_code = 503
+    return {'status': 'not ready', **status}
+
+
+@app.post('/query/stream')
+def query_textbook_stream(payload: QueryRequest):
+    """
+    Answer a query as a stream of Server-Sent Events, so the page range is shown as soon as retrieval finishes.
+    
+    Events, in order:
+        - "answer": the `/query/` response with the raw (unpolished) answer.
+        - "token": `{"text": ...}` fragments of the polished answer as the model generates them; only sent when `payload.polish` is set.
+        - "done": `{"answer": ..., "polished": bool}` with the final answer, which is the raw answer if polishing was not requested or failed (in which case any tokens already sent should be discarded).
+    
+    Parameters:
+        payload (QueryRequest): Query payload, as for `/query/`.
+    
+    Returns:
+        StreamingResponse: A `text/event-stream` response, or a dict with 'error' if no PDF is indexed.
+    """
+    current = current_snapshot()
+    if current.empty: return {'error': 'No PDF indexed. Please upload a PDF first.'}
+
+    results = find_chunks(payload, current)
+    raw_answer = build_response(results)
+
+    def events() -> Iterator[str]:
+        yield sse_event('answer', format_answer(payload.question, results, raw_answer))
+
+        parts: list[str] = []
+        if payload.polish:
+            try:
+                for part in stream_polish(raw_answer):
+                    parts.append(part)
+                    yield sse_event('token', {'text': part})
+            except (OSError, http.client.HTTPException, ValueError): parts = []
+
+        polished = ''.join(parts).strip()
+        yield sse_event('done', {'answer': polished or raw_answer, 'polished': bool(polished)})
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.post('/query/batch')
+def query_textbook_batch(payloads: list[QueryRequest]):
+    """
+    Answer many questions in one request.
+    
+    All questions are embedded in one forward pass and searched with one multi-vector FAISS call (see `retrieve_chunks`); answers that request polishing are served from `polish_cache` or polished concurrently on `executor`.
+    
+    Parameters:
+        payloads (list[QueryRequest]): Questions to answer, each with its own `polish`, `top_k`, `nprobe` and `ef_search` settings.
+    
+    Returns:
+        dict: Contains 'results', a list with one response per question in request order, each shaped like the `/query/` response. If no PDF is indexed, contains 'error' instead.
+    """
+    current = current_snapshot()
+    if current.empty: return {'error': 'No PDF indexed. Please upload a PDF first.'}
+    if not payloads: return {'results': []}
+
+    all_results = retrieve_chunks(payloads, current)
+
+    raw_answers = [build_response(results) for results in all_results]
+    futures = {
+        position: submit_polish(raw_answers[position])
+        for position, payload in enumerate(payloads)
+        if payload.polish
+    }
+
+    return {
+        'results': [
+            format_answer(
+                payload.question,
+                results,
+                futures[position].result() if position in futures else raw_answers[position]
+            )
+            for position, (payload, results) in enumerate(zip(payloads, all_results))
+        ]
+    }
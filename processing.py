@@ -0,0 +1,608 @@
+"""
+Textbook processing shared by the server and its worker processes: PDF page extraction, structure detection, chunking and embedding.
+
+Importing this module has no side effects: it creates no index, caches, threads or model. Process pools started with `spawn` therefore import it, rather than `main`, in every worker. Settings are passed in by the caller instead of being read from `main`'s constants.
+"""
+import re
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, TypedDict, Optional
+
+import numpy as np
+import fitz
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+    from transformers import PreTrainedTokenizerBase
+
+
+class Page(TypedDict):
+    page_number: int
+    text: str
+
+
+class ChunkMetadata(TypedDict):
+    page: int
+    unit: Optional[str]
+    section: Optional[str]
+    section_title: Optional[str]
+    source: Optional[str]
+
+
+class Chunk(TypedDict):
+    text: str
+    metadata: ChunkMetadata
+
+
+def extract_page_range(pdf_path: str, start: int = 0, stop: Optional[int] = None) -> list[Page]:
+    """
+    Extract the text of a contiguous range of pages from a PDF file.
+    
+    Runs inside a worker process, so it opens its own `fitz` handle instead of sharing the parent's document.
+    
+    Parameters:
+        pdf_path (str): Filesystem path to the PDF to read.
+        start (int): 0-based index of the first page to extract.
+        stop (int, optional): 0-based index one past the last page to extract; the end of the document if omitted.
+    
+    Returns:
+        pages (list[Page]): Page dictionaries for pages `start` to `stop - 1`, in page order.
+    """
+    with fitz.open(pdf_path) as doc:
+        if stop is None: stop = doc.page_count
+        return [{'page_number': i + 1, 'text': doc[i].get_text('text').strip()} for i in range(start, stop)]
+
+
+class StructureDetector(ABC):
+    # Detectors that recognise a heading with one regex matched at the start of the stripped line expose it as `pattern`, and the characters such a line can start with as `first_chars`, so CompiledStructurePipeline can fuse them.
+    # `first_chars` is the body of a regex character class, compiled with the pattern's flags, so it can admit exactly what the pattern does (e.g. r'\d' for any Unicode digit).
+    pattern: Optional[re.Pattern] = None
+    first_chars: Optional[str] = None
+
+    @abstractmethod
+    def detect(self, line: str):
+        """
+        Detects a structural element in a single line of text.
+        
+        Returns:
+            dict: Extracted structure fields (for example, 'unit', 'section', or 'section_title') when the line matches a detector's pattern, `None` otherwise.
+        """
+        pass
+
+
+class UnitDetector(StructureDetector):
+    pattern = re.compile(r'^(UNIT|CHAPTER)\s+([IVXLC]+)', re.IGNORECASE)
+    first_chars = 'UuCc'
+
+    def detect(self, line: str):
+        """
+        Detects a unit or chapter heading in a single line of text.
+        
+        Parameters:
+        	line (str): A single line of text to inspect for a leading unit/chapter heading (e.g., "UNIT I", "CHAPTER II").
+        
+        Returns:
+        	dict or None: A dict with key `'unit'` whose value is the detected Roman numeral in uppercase when a heading is found, otherwise `None`.
+        """
+        match = self.pattern.match(line.strip())
+        if match: return {
+            'unit': match.group(2).upper()
+        }
+        return None
+
+
+class NumberedSectionDetector(StructureDetector):
+    pattern = re.compile(r'^(\d+(\.\d+)*)\s+(.*)')
+    first_chars = r'\d'
+
+    def detect(self, line: str):
+        """
+        Detects whether a line contains a numbered section header and extracts its section identifier and title.
+        
+        Parameters:
+            line (str): A single line of text to examine for a leading numbered section (e.g., "1", "1.1", "2.3.4") followed by a title.
+        
+        Returns:
+            dict: Mapping with keys 'section' (the numeric section identifier as a string) and 'section_title' (the section title) when a match is found.
+            None: If the line does not match the numbered-section pattern.
+        """
+        match = self.pattern.match(line.strip())
+        if match: return {
+            'section': match.group(1),
+            'section_title': match.group(3)
+        }
+        return None
+
+
+class StructurePipeline:
+    def __init__(self, detectors: list[StructureDetector]):
+        """
+        Initialize a StructurePipeline with the given detectors and reset internal structure state.
+        
+        Parameters:
+            detectors (list[StructureDetector]): Ordered list of detector instances used to inspect lines and update pipeline state (unit, section, section_title).
+        """
+        self.detectors = detectors
+        self.state = {
+            'unit': None,
+            'section': None,
+            'section_title': None,
+        }
+
+    def process_line(self, line: str):
+        """
+        Update the pipeline state by running each detector against a single line.
+        
+        Parameters:
+            line (str): A single line of text to be examined by the configured detectors.
+        
+        Returns:
+            tuple: (updated, state) where:
+                updated (bool): True if any detector produced an update to the pipeline state, False otherwise.
+                state (dict): A shallow copy of the pipeline's current state (for example: unit, section, section_title).
+        """
+        updated = False
+        for detector in self.detectors:
+            result = detector.detect(line)
+            if result:
+                self.state.update(result)
+                updated = True
+        return updated, self.state.copy()
+
+
+def scoped_pattern(pattern: re.Pattern) -> str:
+    """
+    Return a regex's source wrapped in a group carrying its flags inline, e.g. `(?i:...)`, so it can be embedded in a larger pattern compiled without them.
+    """
+    flags = ''.join(letter for flag, letter in ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x')) if pattern.flags & flag)
+    return f'(?{flags}:{pattern.pattern})' if flags else f'(?:{pattern.pattern})'
+
+
+class CompiledStructurePipeline(StructurePipeline):
+    # Every line boundary `str.splitlines` recognises besides '\n', mapped one-to-one to '\n' so offsets are unchanged and a multiline `^` sees the same lines.
+    line_breaks = str.maketrans(dict.fromkeys('\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029', '\n'))
+
+    def __init__(self, detectors: list[StructureDetector]):
+        """
+        Initialize a pipeline that produces the same updates as `StructurePipeline` with one regex evaluation per line.
+        
+        The patterns of all detectors that expose one are fused into a single regex of optional lookaheads, `(?=(?P<d0>...))?(?=(?P<d1>...))?...`, so every detector's pattern is tried at the start of the line in one scan and each named group records whether that detector matched. Lines whose first character matches none of the detectors' `first_chars` classes are rejected without running the regex. Detectors without a `pattern` are run on every line as before.
+        
+        Parameters:
+            detectors (list[StructureDetector]): Ordered list of detector instances; state updates are applied in this order.
+        """
+        super().__init__(detectors)
+        self.groups = [f'd{i}' if d.pattern is not None else None for i, d in enumerate(detectors)]
+        self.pattern = re.compile(''.join(f'(?=(?P<{g}>{scoped_pattern(d.pattern)}))?' for g, d in zip(self.groups, detectors) if g))
+
+        # Matches the first character of a line any fused pattern could match; None when some fused detector does not say.
+        fused = [d for d in detectors if d.pattern is not None]
+        if any(d.first_chars is None for d in fused): self.first_char = None
+        else: self.first_char = re.compile('|'.join(scoped_pattern(re.compile(f'[{d.first_chars}]', d.pattern.flags)) for d in fused) or '(?!)')
+
+        # Finds the lines any detector could match, as the span from their first non-blank character to the end of the line.
+        if self.first_char is None or None in self.groups: self.candidates = re.compile(r'^\s*(\S.*)', re.MULTILINE)
+        else: self.candidates = re.compile(rf'^\s*((?:{self.first_char.pattern}).*)', re.MULTILINE)
+
+    def update(self, line: str) -> bool:
+        """
+        Apply the detectors that match a stripped line to the pipeline state, running `detect` only for detectors whose pattern matched.
+        
+        Returns:
+            bool: True if any detector updated the state.
+        """
+        match = self.pattern.match(line) if self.first_char is None or self.first_char.match(line) else None
+
+        updated = False
+        for detector, group in zip(self.detectors, self.groups):
+            if group is not None and (match is None or match.group(group) is None): continue
+            result = detector.detect(line)
+            if result:
+                self.state.update(result)
+                updated = True
+        return updated
+
+    def process_line(self, line: str):
+        """
+        Update the pipeline state from a single line.
+        
+        Parameters:
+            line (str): A single line of text to be examined by the configured detectors.
+        
+        Returns:
+            tuple: (updated, state), as returned by `StructurePipeline.process_line`.
+        """
+        updated = self.update(line.strip())
+        return updated, self.state.copy()
+
+    def process_page(self, text: str) -> Iterator[tuple[int, dict]]:
+        """
+        Run structure detection over a whole page in one pass.
+        
+        Candidate lines, those starting with a character admitted by `first_chars`, are located with a single multiline `finditer` over the page text, with its line breaks normalised to '\n' so lines are split as `str.splitlines` splits them, and validated with the fused pattern; all other lines are never visited. The state is only copied for lines that update it.
+        
+        Parameters:
+            text (str): Page text.
+        
+        Yields:
+            tuple[int, dict]: (offset, state) for each line that updated the state, in page order: the offset in `text` of the line's first non-blank character, and a copy of the state after the update.
+        """
+        for match in self.candidates.finditer(text.translate(self.line_breaks)):
+            if self.update(match.group(1).strip()): yield match.start(1), self.state.copy()
+
+
+@lru_cache(maxsize=None)
+def word_run_pattern(count: int, keep: int) -> re.Pattern:
+    """
+    Regex matching up to `count` words of single-space separated text, as many as are available.
+    
+    When `keep` is positive and fewer than `count`, group `keep` spans the run's last `keep` words whenever the run reaches `count` words, so the overlap for the next chunk is known without searching back for it.
+    """
+    if keep <= 0 or keep >= count: return re.compile(rf'\S++(?: \S++){{0,{count - 1}}}')
+    return re.compile(rf'\S++(?: \S++){{0,{count - keep - 1}}}(?: (?P<keep>\S++(?: \S++){{0,{keep - 1}}}))?')
+
+
+def structured_chunker(pages: Iterable[Page], detectors: list[StructureDetector], source_file: str, max_words: int = 350, overlap: int = 50, tokenizer: Optional['PreTrainedTokenizerBase'] = None) -> Iterator[Chunk]:
+    """
+    Split OCR/extracted PDF pages into text chunks while preserving detected structural metadata.
+    
+    Pages are consumed one at a time and chunks are yielded as soon as they are complete, so neither the whole book nor the whole chunk list is held in memory. Headings are located with one `CompiledStructurePipeline.process_page` pass per page; the text between them is buffered as slices of the page, and a chunk is cut as soon as it reaches `max_words` words.
+    
+    When a fast `tokenizer` is given, `max_words` and `overlap` count that tokenizer's tokens instead of words. Each page's segments are tokenized in one batched call, and chunks are still cut between words: a chunk ends at the last word that keeps it within `max_words` tokens, so sized to the embedding model's sequence length, no chunk is truncated when embedded. A single word longer than a whole chunk becomes a chunk of its own.
+    
+    Parameters:
+        pages (Iterable[Page]): Pages with 1-based `page_number` and extracted `text`, in page order.
+        detectors (list[StructureDetector]): Structural detectors used to update unit/section/section_title state at heading lines.
+        source_file (str): Identifier stored in each chunk's `metadata['source']`.
+        max_words (int): Target maximum number of words (or tokens) per chunk before flushing.
+        overlap (int): Number of trailing words (or at most this many tokens) to retain when creating the next chunk (0 disables overlap); must be less than `max_words`.
+        tokenizer (Optional[PreTrainedTokenizerBase]): Fast Hugging Face tokenizer to count tokens with, or None to count words.
+    
+    Yields:
+        Chunk: Chunks in document order, each a dict with:
+            - `text`: concatenated chunk text (str).
+            - `metadata`: dict containing `page` (int), `source` (str) and any detected `unit`, `section`, and `section_title`.
+    
+    Raises:
+        ValueError: If `overlap` is negative or not less than `max_words`; a chunk must hold more than the overlap it starts with.
+    """
+    if not 0 <= overlap < max_words: raise ValueError(f'overlap must be at least 0 and less than max_words ({max_words}), got {overlap}')
+    pipeline = CompiledStructurePipeline(detectors)
+
+    # The buffer holds slices of page text (plus the overlap carried over from the previous chunk) rather than one string per word.
+    # Its size is counted in words, or in tokens when chunking by tokens.
+    buffer: list[str] = []
+    buffer_size = 0
+    current_metadata: ChunkMetadata = {}
+    last_structure = None
+
+    # Token mode only: the buffered slices as (text, starts, tokens, first, last) spans of words first..last-1 of a segment (see `add_tokens`), and how many of the buffered tokens were carried over from the previous chunk.
+    spans: list[tuple[str, list[int], list[int], int, int]] = []
+    carried = 0
+
+    def flush(page_number: int, force_reset: bool = False, carry: Optional[str] = None) -> Optional[Chunk]:
+        """
+        Flushes the current text buffer into a new chunk with page and source metadata.
+        
+        If the buffer is empty this function does nothing. The chunk text is the buffered slices joined by single spaces. After creating the chunk, the buffer is cleared; if `force_reset` is False and a nonzero `overlap` is defined in the enclosing scope, the last `overlap` words (or at most `overlap` tokens) are kept as the start of the next chunk, either as given in `carry` or found by searching back from the end of the buffer.
+        Parameters:
+            page_number (int): Page number to record in the chunk metadata.
+            force_reset (bool): If True, clear the buffer completely after flushing; otherwise retain up to `overlap` trailing words.
+            carry (Optional[str]): The last `overlap` words of the buffer, when the caller already has them as a slice.
+        
+        Returns:
+            Chunk or None: The flushed chunk, or `None` if the buffer was empty.
+        """
+        nonlocal buffer, buffer_size, spans, carried
+        if not buffer: return None
+        text = ' '.join(buffer)
+        chunk: Chunk = {
+            'text': text,
+            'metadata': {
+                'page': page_number,
+                'source': source_file,
+                **current_metadata
+            }
+        }
+
+        if force_reset or overlap == 0:
+            buffer, buffer_size, spans, carried = [], 0, [], 0
+            return chunk
+
+        if tokenizer is not None:
+            spans = trailing_spans(spans, overlap)
+            buffer = [segment[starts[first]:starts[last] - 1] for segment, starts, _, first, last in spans]
+            buffer_size = carried = sum(tokens[last] - tokens[first] for _, _, tokens, first, last in spans)
+            return chunk
+
+        if carry is None:
+            cut = len(text)
+            for _ in range(min(overlap, buffer_size)): cut = text.rfind(' ', 0, cut)
+            carry = text[cut + 1:]
+        buffer, buffer_size = [carry], min(overlap, buffer_size)
+        return chunk
+
+    def add_words(text: str, page_number: int) -> Iterator[Chunk]:
+        """
+        Append a segment of page text, with whitespace normalized to single spaces, to the buffer, flushing a chunk each time it reaches `max_words`.
+        
+        Words are counted by counting spaces. Only a segment that reaches the next cut is matched with `word_run_pattern`, which finds the run of words up to the cut, and the overlap carried into the next chunk, without splitting them out; what is left after the last cut is appended as a single slice.
+        """
+        nonlocal buffer_size
+        if not text: return
+        position = 0
+        remaining = text.count(' ') + 1
+        while remaining >= max_words - buffer_size:
+            needed = max(max_words - buffer_size, 1)
+            match = word_run_pattern(needed, overlap).match(text, position)
+            buffer.append(match.group())
+            buffer_size += needed
+            remaining -= needed
+            position = match.end() + 1
+
+            chunk = flush(page_number, carry=match.group('keep') if match.re.groups else None)
+            if chunk: yield chunk
+
+        if remaining:
+            buffer.append(text[position:])
+            buffer_size += remaining
+
+    def add_tokens(text: str, offsets: list[tuple[int, int]], page_number: int) -> Iterator[Chunk]:
+        """
+        Append a segment of page text, with whitespace normalized to single spaces, to the buffer, flushing a chunk whenever its next word would take it past `max_words` tokens.
+        
+        `offsets` are the segment's token character offsets from the tokenizer. Word i of the segment starts at character `starts[i]` and at token `tokens[i]`; both lists end with an entry just past the last word, so the slice and token count of any run of words are differences of two entries and the cut is found by bisecting `tokens`.
+        """
+        nonlocal buffer, buffer_size, spans, carried
+        if not text: return
+        starts, tokens = [0], [0]
+        for token, (start, _) in enumerate(offsets):
+            if token and text[start - 1] == ' ':
+                starts.append(start)
+                tokens.append(token)
+        starts.append(len(text) + 1)
+        tokens.append(len(offsets))
+
+        first, words = 0, len(starts) - 1
+        while first < words:
+            last = bisect_right(tokens, tokens[first] + max_words - buffer_size, first) - 1
+            if last == first:
+                if buffer_size > carried:
+                    chunk = flush(page_number)
+                    if chunk: yield chunk
+                    continue
+                # Not even the next word fits after the carried overlap: drop the overlap, and take a word longer than a whole chunk on its own.
+                buffer, buffer_size, spans, carried = [], 0, [], 0
+                last = max(bisect_right(tokens, tokens[first] + max_words, first) - 1, first + 1)
+
+            spans.append((text, starts, tokens, first, last))
+            buffer.append(text[starts[first]:starts[last] - 1])
+            buffer_size += tokens[last] - tokens[first]
+            first = last
+            if last < words or buffer_size >= max_words:
+                chunk = flush(page_number)
+                if chunk: yield chunk
+
+    for page in pages:
+        page_number = page['page_number']
+        text = page['text']
+
+        # Cut the page at each heading that changes the structure, with the metadata that applies from there on.
+        cuts: list[tuple[int, ChunkMetadata]] = []
+        for offset, state in pipeline.process_page(text):
+            new_structure = (
+                state.get('unit'),
+                state.get('section'),
+                state.get('section_title')
+            )
+            if new_structure == last_structure: continue
+            cuts.append((offset, {
+                'unit': state['unit'],
+                'section': state['section'],
+                'section_title': state['section_title'],
+            }))
+            last_structure = new_structure
+
+        bounds = [0, *(offset for offset, _ in cuts), len(text)]
+        segments = [' '.join(text[start:end].split()) for start, end in zip(bounds, bounds[1:])]
+        if tokenizer is not None:
+            offsets = tokenizer(segments, add_special_tokens=False, return_offsets_mapping=True, return_attention_mask=False, return_token_type_ids=False, verbose=False)['offset_mapping']
+
+        for i, segment in enumerate(segments):
+            if tokenizer is not None: yield from add_tokens(segment, offsets[i], page_number)
+            else: yield from add_words(segment, page_number)
+            if i == len(cuts): break
+
+            chunk = flush(page_number, force_reset=True)
+            if chunk: yield chunk
+            current_metadata = cuts[i][1]
+
+        chunk = flush(page_number)
+        if chunk: yield chunk
+
+
+def trailing_spans(spans: list[tuple[str, list[int], list[int], int, int]], limit: int) -> list[tuple[str, list[int], list[int], int, int]]:
+    """
+    Return the trailing whole words of a token-mode chunk buffer that together take at most `limit` tokens, as spans (see `structured_chunker`).
+    """
+    kept = []
+    for text, starts, tokens, first, last in reversed(spans):
+        if tokens[last] - tokens[first] > limit:
+            first = bisect_left(tokens, tokens[last] - limit, first, last)
+            if first < last: kept.append((text, starts, tokens, first, last))
+            break
+        kept.append((text, starts, tokens, first, last))
+        limit -= tokens[last] - tokens[first]
+    kept.reverse()
+    return kept
+
+
+def chunk_detectors() -> list[StructureDetector]:
+    """
+    Return fresh instances of the structure detectors used to chunk uploaded textbooks.
+    """
+    return [
+        UnitDetector(),
+        NumberedSectionDetector()
+    ]
+
+
+def timed(items: Iterable, stats: dict, key: str) -> Iterator:
+    """
+    Pass items through unchanged, adding the time spent producing each one to `stats[key]`.
+    
+    Parameters:
+        items (Iterable): Items to pass through; consumed lazily.
+        stats (dict): Dictionary accumulating the time, in seconds.
+        key (str): Key to accumulate under.
+    
+    Yields:
+        Each item of `items`, in order.
+    """
+    iterator = iter(items)
+    while True:
+        started = time.perf_counter()
+        try: item = next(iterator)
+        except StopIteration: return
+        finally: stats[key] = stats.get(key, 0.0) + time.perf_counter() - started
+        yield item
+
+
+def chunk_in_worker(pdf_path: str, source_file: str, tokenizer: Optional['PreTrainedTokenizerBase'], max_size: int, overlap: int, pages: Optional[list[Page]] = None) -> tuple[Optional[list[Page]], list[Chunk], dict]:
+    """
+    Chunk a whole PDF in a chunking worker process (see `main.chunk_uploads`), extracting its pages first unless they are given.
+    
+    The worker does not touch the ingest cache; the caller passes the pages it has cached and records the pages and chunks returned.
+    
+    Returns:
+        tuple: (pages, chunks, stats): the extracted pages (None if `pages` was given), the chunks in document order, and 'parse_seconds' and 'chunk_seconds' as recorded by `main.chunk_pdf`.
+    """
+    stats = {'cached': False, 'parse_seconds': 0.0}
+    extracted = None
+    if pages is None:
+        started = time.perf_counter()
+        pages = extracted = extract_page_range(pdf_path)
+        stats['parse_seconds'] = time.perf_counter() - started
+    chunks = list(timed(structured_chunker(pages, chunk_detectors(), source_file, max_size, overlap, tokenizer), stats, 'chunk_seconds'))
+    return extracted, chunks, stats
+
+
+def load_sentence_model(model_path: str, backend: str, onnx_dir: Path, quantization: str, threads: Optional[int] = None) -> 'SentenceTransformer':
+    """
+    Load a sentence embedding model on CPU with the given inference backend.
+    
+    The ONNX backends need `pip install sentence-transformers[onnx]`. The first time one is used, the model at `model_path` is exported to ONNX (and, for 'onnx-int8', dynamically quantized to int8 with the `quantization` instruction set) under `onnx_dir`; later loads reuse the exported files.
+    
+    Parameters:
+        model_path (str): Directory of the sentence-transformers model.
+        backend (str): 'torch' (PyTorch, full precision), 'onnx' (ONNX Runtime, full precision) or 'onnx-int8' (ONNX Runtime, int8 weights).
+        onnx_dir (Path): Directory the ONNX exports are kept under.
+        quantization (str): Instruction set the int8 model is quantized for, e.g. 'avx2'.
+        threads (int, optional): Intra-op threads of the ONNX Runtime session; ONNX Runtime's default, one per core, if omitted. PyTorch's thread count is set with `torch.set_num_threads` instead.
+    
+    Returns:
+        SentenceTransformer: The loaded model.
+    """
+    # sentence_transformers (and torch with it) takes several seconds to import, so it is imported where the model is loaded.
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    if backend == 'torch': return SentenceTransformer(model_path, device='cpu')
+    if backend not in ('onnx', 'onnx-int8'): raise ValueError(f'Unknown embedding backend: {backend}')
+
+    export_dir = onnx_dir / Path(model_path).name
+    if not (export_dir / 'onnx' / 'model.onnx').exists():
+        SentenceTransformer(model_path, device='cpu', backend='onnx').save_pretrained(str(export_dir))
+
+    session: dict = {}
+    if threads is not None:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        session['session_options'] = options
+    if backend == 'onnx':
+        return SentenceTransformer(str(export_dir), device='cpu', backend='onnx', model_kwargs={'file_name': 'onnx/model.onnx', **session})
+
+    file_name = f'onnx/model_qint8_{quantization}.onnx'
+    if not (export_dir / file_name).exists():
+        model = SentenceTransformer(str(export_dir), device='cpu', backend='onnx', model_kwargs={'file_name': 'onnx/model.onnx'})
+        export_dynamic_quantized_onnx_model(model, quantization, str(export_dir))
+    return SentenceTransformer(str(export_dir), device='cpu', backend='onnx', model_kwargs={'file_name': file_name, **session})
+
+
+def length_batches(lengths: list[int], token_budget: int, bucket: int) -> list[list[int]]:
+    """
+    Group texts into batches of similar token length.
+    
+    Texts are bucketed by token length in steps of `bucket` tokens, longest bucket first, and each bucket is cut into batches whose padded size (longest text times batch size) stays within `token_budget`. Padding is therefore under `bucket` tokens per text, and short texts are encoded in proportionally larger batches.
+    
+    Parameters:
+        lengths (list[int]): Token length of each text.
+        token_budget (int): Maximum padded tokens per batch.
+        bucket (int): Width of the length buckets, in tokens.
+    
+    Returns:
+        list[list[int]]: Positions into `lengths`, one list per batch.
+    """
+    buckets: dict[int, list[int]] = {}
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]): buckets.setdefault((lengths[i] - 1) // bucket, []).append(i)
+
+    batches = []
+    for rows in buckets.values():
+        size = max(1, token_budget // lengths[rows[0]])
+        batches.extend(rows[start:start + size] for start in range(0, len(rows), size))
+    return batches
+
+
+def encode_texts(model: 'SentenceTransformer', texts: list[str], token_budget: int, bucket: int) -> np.ndarray:
+    """
+    Encode texts in batches of similar token length (see `length_batches`), so short section stubs are not padded to the length of full chunks.
+    
+    Parameters:
+        model (SentenceTransformer): Model to encode with.
+        texts (list[str]): Non-empty list of texts.
+        token_budget (int): Maximum padded tokens per forward pass.
+        bucket (int): Width of the length buckets, in tokens.
+    
+    Returns:
+        np.ndarray: Normalized float32 embeddings, one row per text in input order.
+    """
+    lengths = [len(ids) for ids in model.tokenizer(texts, truncation=True, max_length=model.max_seq_length)['input_ids']]
+
+    embeddings = None
+    for rows in length_batches(lengths, token_budget, bucket):
+        encoded = model.encode([texts[i] for i in rows], batch_size=len(rows), normalize_embeddings=True)
+        if embeddings is None: embeddings = np.empty((len(texts), encoded.shape[1]), dtype='float32')
+        embeddings[rows] = encoded
+    return embeddings
+
+
+_worker_embedder: Optional['SentenceTransformer'] = None
+
+
+def init_embed_worker(threads: int, model_path: str, backend: str, onnx_dir: Path, quantization: str):
+    """
+    Load the embedding model in an embedding worker process.
+    
+    Parameters:
+        threads (int): Number of intra-op threads the model may use in this process, with PyTorch or ONNX Runtime.
+        model_path, backend, onnx_dir, quantization: Model to load (see `load_sentence_model`).
+    """
+    import torch
+
+    global _worker_embedder
+    torch.set_num_threads(threads)
+    _worker_embedder = load_sentence_model(model_path, backend, onnx_dir, quantization, threads)
+
+
+def encode_in_worker(texts: list[str], token_budget: int, bucket: int) -> np.ndarray:
+    """
+    Encode texts with the worker process's model (see `encode_texts`).
+    
+    Returns:
+        np.ndarray: Normalized float32 embeddings, one row per text.
+    """
+    return encode_texts(_worker_embedder, texts, token_budget, bucket)